@@ -0,0 +1,179 @@
+import argparse
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from src.InterpolateTorch import InterpolateRifeTorch
+
+
+class BenchmarkInterpolate:
+    """
+    Compares interpolating a clip with every pair starting from the first rife block, and with the flow warm started from the pair before it.
+    Every other frame of the clip is left out and interpolated back from its neighbours, so the output can be compared to the real frame.
+    Reports the time and the convolution FLOPs of each pair, the PSNR of the warm started frames against the cold ones,
+    and the PSNR of both against the frames that were left out.
+    """
+
+    def __init__(self):
+        self.args = self.handleArguments()
+        frames = self.readFrames()
+        height, width, _ = frames[0].shape
+        self.interpolateRifePytorch = InterpolateRifeTorch(
+            interpolateModelPath=self.args.interpolateModel,
+            width=width,
+            height=height,
+            dtype=self.args.precision,
+            flowScale=self.args.flowScale,
+            warmStart=True,
+        )
+        if not self.interpolateRifePytorch.warmStart:
+            raise os.error("The interpolate model can not be warm started!")
+        self.flops = 0
+        self.countFlops(self.interpolateRifePytorch.flownet)
+
+        cold = self.interpolateFrames(frames, warmStart=False)
+        warm = self.interpolateFrames(frames, warmStart=True)
+        self.report("cold", cold)
+        self.report("warm", warm)
+        self.interpolateRifePytorch.reportWarmStarts()
+        warmVsCold = [
+            psnr(warmFrame, coldFrame)
+            for warmFrame, coldFrame in zip(warm["frames"], cold["frames"])
+        ]
+        print(f"warm vs cold PSNR {round(meanPsnr(warmVsCold), 2)}dB")
+
+    def handleArguments(self) -> argparse.Namespace:
+        parser = argparse.ArgumentParser(
+            description="Benchmarks warm starting the rife flow from the previous pair."
+        )
+        parser.add_argument(
+            "-i",
+            "--input",
+            required=True,
+            help="input video path",
+        )
+        parser.add_argument(
+            "--interpolateModel",
+            required=True,
+            help="Model for frame interpolation, a rife model before 4.21",
+        )
+        parser.add_argument(
+            "--frames",
+            help="Number of frames of the clip to benchmark on (default=61)",
+            type=int,
+            default=61,
+        )
+        parser.add_argument(
+            "--flowScale",
+            help="Resolution the interpolation flow is estimated at (default=1)",
+            choices=["auto", "1", "0.5", "0.25"],
+            default="1",
+        )
+        parser.add_argument(
+            "--precision",
+            help="sets precision for model, (auto/float16/float32, default=auto)",
+            default="auto",
+        )
+        return parser.parse_args()
+
+    def readFrames(self) -> list:
+        """
+        Reads the first frames of the input as RGB, the same layout ffmpeg passes to the renderer
+        """
+        video = cv2.VideoCapture(self.args.input)
+        frames = []
+        while len(frames) < self.args.frames:
+            success, frame = video.read()
+            if not success:
+                break
+            frames.append(np.ascontiguousarray(frame[:, :, ::-1]))
+        video.release()
+        if len(frames) < 3:
+            raise os.error("The input needs at least 3 frames!")
+        return frames
+
+    def countFlops(self, flownet: torch.nn.Module):
+        """
+        Adds the multiply-adds of every convolution to self.flops, as the model runs
+        """
+
+        def countConvolution(module, inputs, output):
+            kernel = module.kernel_size[0] * module.kernel_size[1]
+            if isinstance(module, torch.nn.ConvTranspose2d):
+                # every input pixel is spread over the kernel
+                self.flops += (
+                    2
+                    * inputs[0].numel()
+                    * module.out_channels
+                    * kernel
+                    // module.groups
+                )
+            else:
+                self.flops += (
+                    2 * output.numel() * module.in_channels * kernel // module.groups
+                )
+
+        for module in flownet.modules():
+            if isinstance(module, (torch.nn.Conv2d, torch.nn.ConvTranspose2d)):
+                module.register_forward_hook(countConvolution)
+
+    def synchronize(self):
+        if torch.device(self.interpolateRifePytorch.device).type == "cuda":
+            torch.cuda.synchronize()
+
+    def interpolateFrames(self, frames: list, warmStart: bool) -> dict:
+        """
+        Interpolates the middle of every other pair of frames, warm starting each one from the one before it if warmStart is set
+        """
+        interpolateRifePytorch = self.interpolateRifePytorch
+        interpolateRifePytorch.warmStart = warmStart
+        interpolateRifePytorch.uncacheFrame()
+        results = {"frames": [], "times": [], "flops": [], "psnr": []}
+        setupFrame0 = interpolateRifePytorch.frame_to_tensor(frames[0])
+        for index in range(2, len(frames), 2):
+            setupFrame1 = interpolateRifePytorch.frame_to_tensor(frames[index])
+            self.flops = 0
+            self.synchronize()
+            start = time.perf_counter()
+            output = interpolateRifePytorch.processOnDevice(
+                setupFrame0, setupFrame1, 0.5
+            )
+            self.synchronize()
+            results["times"].append(time.perf_counter() - start)
+            results["flops"].append(self.flops)
+            output = interpolateRifePytorch.tensor_to_frame(output)
+            results["frames"].append(output)
+            results["psnr"].append(psnr(output, frames[index - 1]))
+            setupFrame0 = setupFrame1
+        return results
+
+    def report(self, name: str, results: dict):
+        # the first pair of both runs starts cold
+        times = results["times"][1:] or results["times"]
+        flops = results["flops"][1:] or results["flops"]
+        print(
+            f"{name}: {round(1000 * sum(times) / len(times), 2)}ms "
+            + f"{round(sum(flops) / len(flops) / 1e9, 2)} GFLOPs per pair, "
+            + f"PSNR {round(meanPsnr(results['psnr']), 2)}dB against the real frames"
+        )
+
+
+def psnr(frame0: np.ndarray, frame1: np.ndarray) -> float:
+    mse = np.mean((frame0.astype(np.float64) - frame1.astype(np.float64)) ** 2)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255**2 / mse)
+
+
+def meanPsnr(values: list) -> float:
+    # identical frames would make the mean infinite
+    finite = [value for value in values if math.isfinite(value)]
+    return sum(finite) / max(1, len(finite))
+
+
+if __name__ == "__main__":
+    BenchmarkInterpolate()
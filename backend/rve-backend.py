@@ -3,6 +3,8 @@ import os
 import sys
 
 from src.RenderVideo import Render
+from src.Checkpoint import RenderAlreadyComplete
+from src.SegmentRender import SegmentRender
 
 from src.Util import (
     checkForPytorch,
@@ -17,13 +19,24 @@ class HandleApplication:
         self.args = self.handleArguments()
         if not self.args.list_backends:
             self.checkArguments()
-            Render(
+            renderSettings = dict(
                 # model settings
                 inputFile=self.args.input,
                 outputFile=self.args.output,
                 interpolateModel=self.args.interpolateModel,
                 interpolateFactor=self.args.interpolateFactor,
                 upscaleModel=self.args.upscaleModel,
+                batchSize=self.args.batch,
+                dedup=self.args.dedup,
+                dedupThreshold=self.args.dedupThreshold,
+                dedupCacheSize=self.args.dedupCacheSize,
+                skipStatic=self.args.skipStatic,
+                staticThreshold=self.args.staticThreshold,
+                flowScale=self.args.flowScale,
+                liteInterpolateModel=self.args.liteInterpolateModel,
+                tierThreshold=self.args.tierThreshold,
+                warmStart=self.args.warmStart,
+                flowReuse=self.args.flowReuse,
                 # backend settings
                 device="default",
                 backend=self.args.backend,
@@ -36,9 +49,26 @@ class HandleApplication:
                 # misc settingss
                 sceneDetectMethod=self.args.sceneDetectMethod,
                 sceneDetectSensitivity=self.args.sceneDetectSensitivity,
+                sceneDetectWorkers=self.args.sceneDetectWorkers,
                 sharedMemoryID=self.args.shared_memory_id,
                 trt_optimization_level=self.args.tensorrt_opt_profile,
+                queueMemoryMB=self.args.queue_memory_mb,
+                processPipeline=self.args.processPipeline,
+                inferenceWorkers=self.args.inferenceWorkers,
             )
+            if self.args.resume:
+                renderSettings.update(
+                    resume=True,
+                    resumeChunkSize=self.args.resumeChunkSize,
+                )
+            if self.args.segments > 1:
+                SegmentRender(segments=self.args.segments, **renderSettings)
+            else:
+                try:
+                    Render(**renderSettings)
+                except RenderAlreadyComplete:
+                    # the output was stitched from the chunks of the earlier run
+                    pass
         else:
             availableBackends = []
             printMSG = ""
@@ -128,10 +158,71 @@ class HandleApplication:
         )
         parser.add_argument(
             "--interpolateFactor",
-            help="Multiplier for interpolation, will round up to nearest integer for interpolation but the fps will be correct",
+            help="Multiplier for interpolation, can be fractional, only the frames that are kept at the new fps are interpolated",
             type=float,
             default=1.0,
         )
+        parser.add_argument(
+            "--batch",
+            help="Number of frames to upscale in a single model call, only used by the pytorch backend (default=1)",
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            "--dedup",
+            help="Reuse the upscaled output of frames that are duplicates of the previous frame, or of a recent frame",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--dedupThreshold",
+            help="Mean absolute difference (0-255) of downscaled frames, under which a frame counts as a duplicate (default=0.5)",
+            type=float,
+            default=0.5,
+        )
+        parser.add_argument(
+            "--dedupCacheSize",
+            help="Number of recent upscaled frames kept to reuse for repeated frames (default=4)",
+            type=int,
+            default=4,
+        )
+        parser.add_argument(
+            "--skipStatic",
+            help="Blend or repeat the frames of pairs with next to no motion, instead of interpolating them",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--staticThreshold",
+            help="Mean absolute difference (0-255) of downscaled frames, under which a pair counts as static (default=1.0)",
+            type=float,
+            default=1.0,
+        )
+        parser.add_argument(
+            "--flowScale",
+            help="Resolution the interpolation flow is estimated at, frames are still warped at full resolution, auto picks it from the resolution and changes the output of large videos (default=1)",
+            choices=["auto", "1", "0.5", "0.25"],
+            default="1",
+        )
+        parser.add_argument(
+            "--liteInterpolateModel",
+            help="A cheaper rife model for scenes that barely move, the interpolate model renders the rest, scenes come from scene detection, pytorch backend only",
+            default=None,
+        )
+        parser.add_argument(
+            "--tierThreshold",
+            help="Mean flow in pixels, above which a scene is interpolated with the interpolate model instead of the lite one (default=3.0)",
+            type=float,
+            default=3.0,
+        )
+        parser.add_argument(
+            "--warmStart",
+            help="Start the interpolation flow of each pair from the flow of the pair before it, skipping the coarsest block, falls back to a full pass when the motion changes, pytorch backend with a single inference worker only",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--flowReuse",
+            help="When upscaling and interpolating, estimate the interpolation flow at the input resolution and warp the upscaled frames with it, instead of running the interpolate model on the upscaled frames, pytorch backend only",
+            action="store_true",
+        )
         parser.add_argument(
             "--precision",
             help="sets precision for model, (auto/float16/float32, default=auto)",
@@ -145,7 +236,7 @@ class HandleApplication:
         )
         parser.add_argument(
             "--sceneDetectMethod",
-            help="Scene change detection to avoid interpolating transitions. (options=pyscenedetect, ffmpeg, none)",
+            help="Scene change detection to avoid interpolating transitions. (options=pyscenedetect, ffmpeg, thumbnail, inline, none), thumbnail has ffmpeg decode small thumbnails that are scored in batches with numpy, inline scores the frames as they are decoded for rendering, instead of decoding the video in a separate pass first.",
             type=str,
             default="pyscenedetect",
         )
@@ -155,6 +246,12 @@ class HandleApplication:
             type=float,
             default=2.0,
         )
+        parser.add_argument(
+            "--sceneDetectWorkers",
+            help="Number of processes pyscenedetect runs in, each one detects a part of the video (default=1)",
+            type=int,
+            default=1,
+        )
         parser.add_argument(
             "--overwrite",
             help="Overwrite output video if it already exists.",
@@ -182,6 +279,40 @@ class HandleApplication:
             type=str,
             default=None,
         )
+        parser.add_argument(
+            "--segments",
+            help="Split the video into this many keyframe aligned segments, and render them in parallel processes (default=1)",
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            "--resume",
+            help="Write the output in chunks, and continue from the last finished chunk if a previous render with the same settings was interrupted",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--resumeChunkSize",
+            help="Number of input frames in each chunk of a resumable render (default=1000)",
+            type=int,
+            default=1000,
+        )
+        parser.add_argument(
+            "--queue-memory-mb",
+            help="Memory budget in MB of the frames waiting in the read and write queues, the queues hold fewer frames at high resolutions (default=2048)",
+            type=int,
+            default=2048,
+        )
+        parser.add_argument(
+            "--processPipeline",
+            help="Decode and encode the video in their own processes, frames are passed to and from the render through shared memory",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--inferenceWorkers",
+            help="Number of threads running the model at once, frames are put back in order before they are written, pytorch backend only (default=1)",
+            type=int,
+            default=1,
+        )
         parser.add_argument(
             "--list_backends",
             help="list out available backends",
@@ -218,6 +349,26 @@ class HandleApplication:
             except ImportError as e:
                 raise ImportError(f"Cannot use NCNN as the backend! {e}")
 
+        if self.args.segments > 1 and (
+            self.args.benchmark or self.args.output == "PIPE"
+        ):
+            raise os.error("Segment rendering needs an output file!")
+
+        if self.args.resume and (self.args.segments > 1 or self.args.output == "PIPE"):
+            raise os.error(
+                "Resuming needs an output file, and can not be used with segments!"
+            )
+
+        if self.args.processPipeline and self.args.segments > 1:
+            # segments already render in worker processes, which can not start processes of their own
+            raise os.error("The process pipeline can not be used with segments!")
+
+        if self.args.inferenceWorkers < 1:
+            raise os.error("There has to be at least 1 inference worker!")
+
+        if self.args.queue_memory_mb <= 0:
+            raise os.error("Queue memory budget must be above 0!")
+
         if os.path.isfile(self.args.output) and not self.args.overwrite:
             raise os.error("Output file already exists!")
 
@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import hashlib
+
+from .FFmpeg import concatVideos
+from .Util import printAndLog, log
+
+
+def hashModel(modelPath: str) -> str:
+    """
+    Hashes every file that makes up a model, ncnn models are a folder or a .param/.bin pair
+    """
+    if os.path.isdir(modelPath):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(modelPath)
+            for name in names
+        )
+    elif os.path.isfile(modelPath):
+        files = [modelPath]
+    else:
+        files = [
+            modelPath + extension
+            for extension in (".param", ".bin")
+            if os.path.isfile(modelPath + extension)
+        ]
+    sha256 = hashlib.sha256()
+    for file in files:
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+    return sha256.hexdigest()
+
+
+class RenderAlreadyComplete(Exception):
+    """
+    Raised by Render when every chunk of a resumed render is already done, the output is stitched from them before it is raised
+    """
+
+
+class RenderCheckpoint:
+    """
+    Keeps track of a resumable render.
+    The output is encoded in chunks of chunkSize input frames, each chunk is its own file in the checkpoint directory.
+    A manifest records the frame range of every finished chunk, with the model hashes and settings of the render.
+    If the settings do not match on restart, the old chunks are thrown away.
+
+    Args:
+        outputFile (str): The path to the final output file, the checkpoint directory is placed next to it.
+        settings (dict): Anything that changes the rendered frames, compared on restart.
+        modelPaths (list): The models used by the render, these are hashed.
+        chunkSize (int): The number of input frames per chunk.
+        extension (str): The extension of the chunk files.
+    """
+
+    def __init__(
+        self,
+        outputFile: str,
+        settings: dict,
+        modelPaths: list[str],
+        chunkSize: int = 1000,
+        extension: str = ".mkv",
+    ):
+        self.directory = outputFile + ".resume"
+        self.manifestPath = os.path.join(self.directory, "manifest.json")
+        self.chunkSize = chunkSize
+        self.extension = extension
+        self.manifest = {
+            "settings": settings,
+            "modelHash": hashlib.sha256(
+                "".join(hashModel(path) for path in modelPaths).encode()
+            ).hexdigest(),
+            "chunkSize": chunkSize,
+            "chunks": [],
+        }
+
+        if os.path.isfile(self.manifestPath):
+            with open(self.manifestPath, "r") as f:
+                oldManifest = json.load(f)
+            if all(
+                oldManifest.get(key) == self.manifest[key]
+                for key in ("settings", "modelHash", "chunkSize")
+            ):
+                self.manifest["chunks"] = oldManifest["chunks"]
+                printAndLog(
+                    f"Resuming render, {len(self.manifest['chunks'])} chunks are already done"
+                )
+            else:
+                printAndLog(
+                    "Resume data does not match the current render settings, starting over"
+                )
+                self.remove()
+        os.makedirs(self.directory, exist_ok=True)
+        self.saveManifest()
+
+    def saveManifest(self):
+        # write to a temporary file first, so a crash never leaves a half written manifest
+        tempPath = self.manifestPath + ".tmp"
+        with open(tempPath, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tempPath, self.manifestPath)
+
+    def chunkPath(self, chunk: int) -> str:
+        return os.path.join(self.directory, f"chunk_{chunk:05d}{self.extension}")
+
+    def firstMissingChunk(self) -> int:
+        """
+        Returns the first chunk that is not finished, everything after it is rendered again
+        """
+        finishedChunks = {chunk["index"] for chunk in self.manifest["chunks"]}
+        chunk = 0
+        while chunk in finishedChunks:
+            chunk += 1
+        return chunk
+
+    def isComplete(self, totalFrames: int) -> bool:
+        """
+        totalFrames, the number of input frames (or pairs when interpolating) the render covers
+        """
+        return self.firstMissingChunk() * self.chunkSize >= totalFrames
+
+    def markComplete(self, chunk: int, startFrame: int, endFrame: int):
+        log(f"Finished chunk {chunk}, frames {startFrame}-{endFrame}")
+        self.manifest["chunks"] = [
+            finishedChunk
+            for finishedChunk in self.manifest["chunks"]
+            if finishedChunk["index"] != chunk
+        ]
+        self.manifest["chunks"].append(
+            {
+                "index": chunk,
+                "startFrame": startFrame,
+                "endFrame": endFrame,
+                "file": os.path.basename(self.chunkPath(chunk)),
+            }
+        )
+        self.saveManifest()
+
+    def stitch(self, outputFile: str, audioFile: str, overwrite: bool = False):
+        """
+        Joins every finished chunk into the output file, then removes the checkpoint
+        """
+        chunks = sorted(self.manifest["chunks"], key=lambda chunk: chunk["index"])
+        printAndLog(f"Joining {len(chunks)} chunks")
+        concatVideos(
+            [os.path.join(self.directory, chunk["file"]) for chunk in chunks],
+            outputFile,
+            audioFile=audioFile,
+            overwrite=overwrite,
+        )
+        self.remove()
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
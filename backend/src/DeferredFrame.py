@@ -0,0 +1,27 @@
+import threading
+
+
+class DeferredFrame:
+    """
+    A frame that the prefetch stage has set up, with the model that still has to run on it deferred to the render stage.
+    Every frame is in two pairs, which can be in different render threads, the first one to call get runs the model,
+    the other waits for it, so the model runs once for each frame.
+
+    Args:
+        frame: The frame as the prefetch stage set it up.
+        setup: Takes the frame, and returns it after the model has run on it.
+    """
+
+    def __init__(self, frame, setup):
+        self.frame = frame
+        self.setup = setup
+        self.lock = threading.Lock()
+        self.result = None
+
+    def get(self):
+        with self.lock:
+            if self.result is None:
+                self.result = self.setup(self.frame)
+                # the set up frame is not needed once the model has run on it
+                self.frame = None
+            return self.result
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .Util import printAndLog
+
+# returned by check when the frame matches the last frame that was rendered
+PREVIOUS_FRAME = "previous_frame"
+
+
+class DuplicateFrameDetector:
+    """
+    Finds frames that do not need to go through the model again, like anime drawn on twos or a title card that repeats.
+    A frame is a duplicate of the last rendered frame if the mean absolute difference of the downsampled frames is under the threshold.
+    Frames are always compared to the frame whose output is reused, so a slow fade can not creep past the threshold one frame at a time.
+    The outputs of the most recent frames are also kept in a small LRU cache, keyed by the hash of the frame,
+    frames are only hashed when they are not a duplicate of the last rendered frame.
+    Frames are checked in the prefetch stage and outputs are stored by the render stage, so the cache is locked.
+
+    Args:
+        width (int): The width of the frames.
+        height (int): The height of the frames.
+        threshold (float, optional): Mean absolute difference (0-255) under which a frame is a duplicate. Defaults to 0.5.
+        cacheSize (int, optional): The number of outputs kept in the LRU cache. Defaults to 4.
+        downsample (int, optional): Only every nth pixel in each direction is compared. Defaults to 8.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        threshold: float = 0.5,
+        cacheSize: int = 4,
+        downsample: int = 8,
+    ):
+        self.width = width
+        self.height = height
+        self.threshold = threshold
+        self.cacheSize = max(1, cacheSize)
+        self.downsample = downsample
+        self.cache = OrderedDict()
+        self.cacheLock = threading.Lock()
+        self.referenceThumbnail = None
+        self.totalFrames = 0
+        self.duplicateFrames = 0
+        self.cachedFrames = 0
+
+    def thumbnail(self, frame) -> np.ndarray:
+        return (
+            np.frombuffer(frame, dtype=np.uint8)
+            .reshape(self.height, self.width, 3)[:: self.downsample, :: self.downsample]
+            .astype(np.int16)
+        )
+
+    def check(self, frame) -> tuple:
+        """
+        Returns (key, match)
+        key: the hash of the frame, used to store its output, None for a duplicate of the last rendered frame
+        match: PREVIOUS_FRAME if the output of the last rendered frame can be reused,
+        the cached output if an identical frame was rendered recently,
+        or None if the frame has to be rendered
+        """
+        self.totalFrames += 1
+        thumbnail = self.thumbnail(frame)
+        if (
+            self.referenceThumbnail is not None
+            and np.mean(np.abs(thumbnail - self.referenceThumbnail)) <= self.threshold
+        ):
+            self.duplicateFrames += 1
+            return None, PREVIOUS_FRAME
+
+        self.referenceThumbnail = thumbnail
+        key = hashlib.blake2b(frame, digest_size=16).digest()
+        with self.cacheLock:
+            output = self.cache.get(key)
+            if output is not None:
+                self.cache.move_to_end(key)
+        if output is not None:
+            self.cachedFrames += 1
+            return key, output
+        return key, None
+
+    def store(self, key, output):
+        with self.cacheLock:
+            self.cache[key] = output
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+    def report(self):
+        reused = self.duplicateFrames + self.cachedFrames
+        hitRate = 100 * reused / max(1, self.totalFrames)
+        printAndLog(
+            f"Reused {reused} of {self.totalFrames} frames ({round(hitRate, 1)}%), "
+            + f"{self.duplicateFrames} duplicates of the previous frame, {self.cachedFrames} from the cache"
+        )
@@ -1,20 +1,183 @@
 import cv2
 import os
+import re
+import multiprocessing
 import subprocess
 import queue
 import sys
 import time
 import math
 from tqdm import tqdm
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # windows, the pipe size can not be changed
 from multiprocessing import shared_memory
+from .FrameBuffer import FrameBufferRing
+from .SharedFrameRing import SharedFrameRing, FLAG_END_OF_STREAM
+from .TimestepScheduler import TimestepScheduler
 from .Util import currentDirectory, log, printAndLog
 
+# queues never hold more frames than this, more does not make the render faster
+MAX_QUEUE_SIZE = 50
+# the reader has to stay a few frames ahead for inline scene detection, the writer only needs to be fed
+MIN_READ_QUEUE_SIZE = 4
+MIN_WRITE_QUEUE_SIZE = 2
+# read buffers that are not in either queue, the one being read into and the ones the render stage holds
+EXTRA_READ_BUFFERS = 4
+# write buffers that are not in the write queue, the one being copied into and the one ffmpeg is fed from
+EXTRA_WRITE_BUFFERS = 2
+# F_SETPIPE_SZ, only in the fcntl module from python 3.10
+F_SETPIPE_SZ = 1031
+# how often the writer checks if the encoder process is still alive, while it waits for a free buffer
+ENCODER_POLL_SECONDS = 1
+# how often the decoder process checks if the render process is still alive, while it waits for a free buffer
+DECODER_POLL_SECONDS = 1
+
+
+def readFrameInto(pipe, frame: memoryview) -> int:
+    """
+    Fills frame from the read pipe, a raw pipe can return less than asked for, so this reads until the frame is full or the pipe ends.
+    Returns the number of bytes read.
+    """
+    bytesRead = 0
+    while bytesRead < len(frame):
+        read = pipe.readinto(frame[bytesRead:])
+        if not read:
+            break
+        bytesRead += read
+    return bytesRead
+
+
+def setPipeSize(pipe, size: int):
+    """
+    Raises the size of a pipe on linux, so ffmpeg is not stopped every 64KB while a frame is read.
+    The size is capped by /proc/sys/fs/pipe-max-size.
+    """
+    if fcntl is None:
+        return
+    try:
+        with open("/proc/sys/fs/pipe-max-size", "r") as f:
+            size = min(size, int(f.read()))
+        fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, size)
+    except (OSError, ValueError) as e:
+        log(f"Unable to set the pipe size: {e}")
+
+
+def decodeFrames(command: list[str], frameCount: int, ringArgs: tuple):
+    """
+    Runs in the decoder process of a process pipeline, reads every frame into a free slot of the shared ring and publishes it.
+    The end of the stream is always published, with the number of frames that were read, so the render never waits on a decoder that failed.
+    If the render process is gone, no slot is freed again, and the decoder stops.
+    """
+    ring = SharedFrameRing.attach(*ringArgs)
+    frameIndex = 0
+    try:
+        readProcess = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+        )
+        setPipeSize(readProcess.stdout, ring.frameSize)
+        while frameIndex < frameCount:
+            slot = acquireReadSlot(ring)
+            if slot is None:
+                break
+            if readFrameInto(readProcess.stdout, ring.views[slot]) != ring.frameSize:
+                ring.free(slot)
+                break
+            ring.publish(slot, frameIndex, ring.frameSize)
+            frameIndex += 1
+        readProcess.stdout.close()
+        readProcess.terminate()
+    finally:
+        ring.publishEndOfStream(frameIndex)
+        ring.close()
+
+
+def acquireReadSlot(ring: SharedFrameRing) -> int:
+    """
+    Waits for a free slot of the read ring in the decoder process, returns None if the render process has exited
+    """
+    while True:
+        try:
+            return ring.acquire(timeout=DECODER_POLL_SECONDS)
+        except queue.Empty:
+            if not multiprocessing.parent_process().is_alive():
+                return None
+
+
+def encodeFrames(command: list[str], ringArgs: tuple):
+    """
+    Runs in the encoder process of a process pipeline, feeds every published slot of the shared ring to ffmpeg, until the end of the stream.
+    Exits with the return code of ffmpeg.
+    """
+    ring = SharedFrameRing.attach(*ringArgs)
+    writeProcess = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        while True:
+            slot, frameIndex, size, flags = ring.receive()
+            if flags & FLAG_END_OF_STREAM:
+                break
+            writeProcess.stdin.write(ring.views[slot][:size])
+            ring.free(slot)
+    finally:
+        try:
+            writeProcess.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg already exited, its return code says why
+        writeProcess.wait()
+        ring.close()
+    sys.exit(writeProcess.returncode)
+
+
+def probeVideoTiming(inputFile: str) -> tuple[float, bool]:
+    """
+    Returns when the first video frame starts, relative to the start of the file, and if the video has a variable frame rate.
+    Input seeking already starts from the start of the file, the first video frame can come later than it, like after a leading audio packet.
+    The frame rate counts as variable when the average frame rate (fps) of the stream does not match its base frame rate (tbr).
+    """
+    command = [
+        f"{os.path.join(currentDirectory(),'bin','ffmpeg')}",
+        "-hide_banner",
+        "-i",
+        f"{inputFile}",
+        "-map",
+        "0:v:0",
+        "-vf",
+        "showinfo",
+        "-frames:v",
+        "1",
+        "-f",
+        "null",
+        "-",
+    ]
+    output = subprocess.run(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    ).stderr
+    # ffmpeg shifts the timestamps by the start of the file, so this is the offset of the first frame
+    startTime = re.search(r"pts_time:\s*(-?[\d.]+)", output)
+    startTime = float(startTime.group(1)) if startTime else 0.0
+    rates = {}
+    stream = re.search(r"Stream #\S+: Video:.*", output)
+    if stream is not None:
+        for value, thousands, name in re.findall(
+            r"([\d.]+)(k?) (fps|tbr)", stream.group(0)
+        ):
+            rates[name] = float(value) * (1000 if thousands else 1)
+    variableFrameRate = (
+        len(rates) == 2 and abs(rates["fps"] - rates["tbr"]) > 0.01 * rates["tbr"]
+    )
+    return startTime, variableFrameRate
+
 
 class FFMpegRender:
     """Args:
         inputFile (str): The path to the input file.
         outputFile (str): The path to the output file.
-        interpolateFactor (int, optional): Sets the multiplier for the framerate when interpolating. Defaults to 1.
+        interpolateFactor (float, optional): Sets the multiplier for the framerate when interpolating, can be fractional. Defaults to 1.
         upscaleTimes (int, optional): Upscaling factor. Defaults to 1.
         encoder (str, optional): The exact name of the encoder ffmpeg will use. Defaults to "libx264".
         pixelFormat (str, optional): The pixel format ffmpeg will use. Defaults to "yuv420p".
@@ -26,6 +189,13 @@ class FFMpegRender:
         shm (shared_memory.SharedMemory, optional): Shared memory object. Defaults to None.
         inputFrameChunkSize (int, optional): Size of input frame chunks. Defaults to None.
         outputFrameChunkSize (int, optional): Size of output frame chunks. Defaults to None.
+        startFrame (int, optional): Frame the reader seeks to before reading. Defaults to 0.
+        copyAudio (bool, optional): Mux the audio of the input file into the output. Defaults to True.
+        checkpoint (RenderCheckpoint, optional): Writes the output in resumable chunks. Defaults to None.
+        sceneDetector (InlineSceneDetect, optional): Scores every frame as it is read for scene changes. Defaults to None.
+        queueMemoryMB (int, optional): Memory the frames waiting in the read and write queues can use, split evenly between them. Defaults to 2048.
+        extraReadBuffers (int, optional): Read buffers held between the read and write queues, by the stages of the render. Defaults to 0.
+        processPipeline (bool, optional): Decode and encode in their own processes, frames are passed through shared memory. Defaults to False.
     pass
     Gets the properties of the video file.
     Args:
@@ -62,7 +232,7 @@ class FFMpegRender:
         self,
         inputFile: str,
         outputFile: str,
-        interpolateFactor: int = 1,
+        interpolateFactor: float = 1,
         upscaleTimes: int = 1,
         encoder: str = "libx264",
         pixelFormat: str = "yuv420p",
@@ -74,6 +244,13 @@ class FFMpegRender:
         shm: shared_memory.SharedMemory = None,
         inputFrameChunkSize: int = None,
         outputFrameChunkSize: int = None,
+        startFrame: int = 0,
+        copyAudio: bool = True,
+        checkpoint=None,
+        sceneDetector=None,
+        queueMemoryMB: int = 2048,
+        extraReadBuffers: int = 0,
+        processPipeline: bool = False,
     ):
         """
         Generates FFmpeg I/O commands to be used with VideoIO
@@ -85,6 +262,12 @@ class FFMpegRender:
         encoder: str, The exact name of the encoder ffmpeg will use (default=libx264)
         pixelFormat: str, The pixel format ffmpeg will use, (default=yuv420p)
         overwrite: bool, overwrite existing output file if it exists
+        startFrame: int, the frame the reader seeks to, used when rendering a segment of the video
+        copyAudio: bool, mux the audio of the input file into the output, disabled for segments that are joined later
+        checkpoint: RenderCheckpoint, if set the output is written in chunks, that are joined once the render is done
+        sceneDetector: InlineSceneDetect, if set every frame is scored for scene changes as it is read, instead of decoding the video twice
+        queueMemoryMB: int, the memory budget of the frame queues, the number of frames they hold is worked out from the frame sizes
+        processPipeline: bool, ffmpeg is read from and written to by separate processes, so the render process only spends its time on the models
         """
         self.inputFile = inputFile
         self.outputFile = outputFile
@@ -92,7 +275,8 @@ class FFMpegRender:
         # upsacletimes will be set to the scale of the loaded model with spandrel
         self.upscaleTimes = upscaleTimes
         self.interpolateFactor = interpolateFactor
-        self.ceilInterpolateFactor = math.ceil(self.interpolateFactor)
+        # maps output frames to the source frames, so only frames that are kept get rendered
+        self.timestepScheduler = TimestepScheduler(self.interpolateFactor)
         self.encoder = encoder
         self.pixelFormat = pixelFormat
         self.benchmark = benchmark
@@ -100,20 +284,103 @@ class FFMpegRender:
         self.readingDone = False
         self.writingDone = False
         self.writeOutPipe = False
+        # a copy of a written frame, replaced by updatePreview once writeOutInformation has shown it
         self.previewFrame = None
+        self.previewShown = False
         self.crf = crf
         self.frameSetupFunction = frameSetupFunction
         self.sharedMemoryID = sharedMemoryID
         self.shm = shm
         self.inputFrameChunkSize = inputFrameChunkSize
         self.outputFrameChunkSize = outputFrameChunkSize
-        
-        self.totalOutputFrames = self.totalInputFrames * self.ceilInterpolateFactor
+        self.startFrame = startFrame
+        # seeking to startFrame is done by time, from the first video frame
+        self.videoStartTime = probeVideoTiming(inputFile)[0] if startFrame > 0 else 0.0
+        self.copyAudio = copyAudio
+        self.checkpoint = checkpoint
+        self.sceneDetector = sceneDetector
+        self.processPipeline = processPipeline
+        # spawn, as cuda can not be used in a forked process
+        self.processContext = multiprocessing.get_context("spawn")
+
+        self.totalOutputFrames = self.timestepScheduler.outputFramesBefore(
+            self.totalInputFrames
+        )
 
         self.writeOutPipe = self.outputFile == "PIPE"
 
-        self.readQueue = queue.Queue(maxsize=50)
-        self.writeQueue = queue.Queue(maxsize=50)
+        # half of the budget each, large upscaled frames would otherwise fill up all of the memory
+        queueBytes = queueMemoryMB * 1024 * 1024 // 2
+        self.readQueue = queue.Queue(
+            maxsize=self.getQueueSize(
+                queueBytes, self.inputFrameChunkSize, MIN_READ_QUEUE_SIZE
+            )
+        )
+        self.writeQueue = queue.Queue(
+            maxsize=self.getQueueSize(
+                queueBytes, self.outputFrameChunkSize, MIN_WRITE_QUEUE_SIZE
+            )
+        )
+        log(
+            f"Queue sizes: read {self.readQueue.maxsize} frames, write {self.writeQueue.maxsize} frames"
+        )
+        # frames in the write queue can be source frames that are written out as is, so the ring has to cover both queues
+        self.readBuffers = None
+        self.writeBuffers = None
+        if self.inputFrameChunkSize:
+            readSlots = (
+                self.readQueue.maxsize
+                + self.writeQueue.maxsize
+                + EXTRA_READ_BUFFERS
+                + extraReadBuffers
+            )
+            if self.processPipeline:
+                self.readBuffers = SharedFrameRing(
+                    self.inputFrameChunkSize, readSlots, self.processContext
+                )
+            else:
+                self.readBuffers = FrameBufferRing(self.inputFrameChunkSize, readSlots)
+        self.queueSamples = 0
+        self.readQueueFill = 0
+        self.writeQueueFill = 0
+        self.readQueueFull = 0
+        self.writeQueueFull = 0
+
+    def getQueueSize(self, queueBytes: int, frameSize: int, minimum: int) -> int:
+        """
+        Returns the number of frames of frameSize that fit in queueBytes, the minimum wins over the budget.
+        """
+        if not frameSize:
+            return MAX_QUEUE_SIZE
+        return max(minimum, min(MAX_QUEUE_SIZE, queueBytes // frameSize))
+
+    def sampleQueues(self):
+        """
+        Records how full the queues are, a full read queue means rendering is the bottleneck, a full write queue means encoding is.
+        """
+        readSize = self.readQueue.qsize()
+        writeSize = self.writeQueue.qsize()
+        self.queueSamples += 1
+        self.readQueueFill += readSize
+        self.writeQueueFill += writeSize
+        self.readQueueFull += readSize >= self.readQueue.maxsize
+        self.writeQueueFull += writeSize >= self.writeQueue.maxsize
+
+    def reportQueues(self):
+        if self.queueSamples == 0:
+            return
+        self.reportQueue("Read", self.readQueue, self.readQueueFill, self.readQueueFull)
+        self.reportQueue(
+            "Write", self.writeQueue, self.writeQueueFill, self.writeQueueFull
+        )
+
+    def reportQueue(self, name: str, frameQueue: queue.Queue, fill: int, full: int):
+        averageFill = round(fill / self.queueSamples, 1)
+        fullPercent = round(100 * full / self.queueSamples, 1)
+        printAndLog(
+            f"{name} queue: {averageFill}/{frameQueue.maxsize} frames on average, "
+            + f"full {fullPercent}% of the time"
+        )
 
     def getVideoProperties(self, inputFile: str = None):
         log("Getting Video Properties...")
@@ -136,8 +403,18 @@ class FFMpegRender:
         log("Generating FFmpeg READ command...")
         command = [
             f"{os.path.join(currentDirectory(),'bin','ffmpeg')}",
+        ]
+        if self.startFrame > 0:
+            # seek half a frame early, so float rounding never skips the first frame of the segment
+            command += [
+                "-ss",
+                f"{self.videoStartTime + (self.startFrame - 0.5) / self.fps}",
+            ]
+        command += [
             "-i",
             f"{self.inputFile}",
+            "-frames:v",
+            f"{self.totalInputFrames - 1}",
             "-f",
             "image2pipe",
             "-pix_fmt",
@@ -150,8 +427,12 @@ class FFMpegRender:
         ]
         return command
 
-    def getFFmpegWriteCommand(self):
+    def getFFmpegWriteCommand(self, outputFile: str = None, overwrite: bool = None):
         log("Generating FFmpeg WRITE command...")
+        if outputFile is None:
+            outputFile = self.outputFile
+        if overwrite is None:
+            overwrite = self.overwrite
         if not self.benchmark:
             # maybe i can split this so i can just use ffmpeg normally like with vspipe
             command = [
@@ -165,48 +446,144 @@ class FFMpegRender:
                 "-s",
                 f"{self.width * self.upscaleTimes}x{self.height * self.upscaleTimes}",
                 "-r",
-                f"{self.fps * self.ceilInterpolateFactor}",
+                f"{self.fps * self.interpolateFactor}",
                 "-i",
                 "-",
-                "-i",
-                f"{self.inputFile}",
+            ]
+            if self.copyAudio:
+                command += [
+                    "-i",
+                    f"{self.inputFile}",
+                ]
+            command += [
                 "-r",
                 f"{self.fps * self.interpolateFactor}",
                 f"-crf",
                 f"{self.crf}",
                 "-pix_fmt",
                 self.pixelFormat,
-                "-c:a",
-                "copy",
+            ]
+            if self.copyAudio:
+                command += [
+                    "-c:a",
+                    "copy",
+                ]
+            else:
+                command.append("-an")
+            command += [
                 "-loglevel",
                 "error",
             ]
             for i in self.encoder.split():
                 command.append(i)
             command.append(
-                f"{self.outputFile}",
+                f"{outputFile}",
             )
 
-            if self.overwrite:
+            if overwrite:
                 command.append("-y")
             return command
 
     def readinVideoFrames(self):
+        """
+        Reads every frame into a free slot of readBuffers, and puts the slot in the readQueue.
+        The pipe is unbuffered, so ffmpeg writes straight into the slot with no copy in between.
+        """
+        if self.processPipeline:
+            self.receiveVideoFrames()
+            return
         log("Starting Video Read")
         self.readProcess = subprocess.Popen(
             self.getFFmpegReadCommand(),
             stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
+            bufsize=0,
         )
+        setPipeSize(self.readProcess.stdout, self.inputFrameChunkSize)
         for i in range(self.totalInputFrames - 1):
-            chunk = self.readProcess.stdout.read(self.inputFrameChunkSize)
-            self.readQueue.put(chunk)
+            slot = self.readBuffers.acquire()
+            frame = self.readBuffers.views[slot]
+            if readFrameInto(self.readProcess.stdout, frame) != len(frame):
+                # ffmpeg ran out of frames before the frame count said it would
+                log(f"Video ended early, at frame {i}")
+                self.readBuffers.release(frame)
+                break
+            if self.sceneDetector is not None:
+                self.sceneDetector.process(frame)
+            self.readQueue.put(slot)
         log("Ending Video Read")
+        if self.sceneDetector is not None:
+            self.sceneDetector.finish()
         self.readQueue.put(None)
         self.readingDone = True
         self.readProcess.stdout.close()
         self.readProcess.terminate()
 
+    def receiveVideoFrames(self):
+        """
+        Starts the decoder process, which reads every frame into a slot of the shared readBuffers, and puts the slots it publishes in the readQueue.
+        Inline scene detection still runs here, as the detector has to be read by the render stage.
+        """
+        log("Starting Video Read in a decoder process")
+        decoder = self.processContext.Process(
+            target=decodeFrames,
+            args=(
+                self.getFFmpegReadCommand(),
+                self.totalInputFrames - 1,
+                self.readBuffers.getAttachArgs(),
+            ),
+            # an error in the render never waits on the decoder at exit
+            daemon=True,
+        )
+        decoder.start()
+        while True:
+            slot, frameIndex, size, flags = self.readBuffers.receive()
+            if flags & FLAG_END_OF_STREAM:
+                if frameIndex < self.totalInputFrames - 1:
+                    log(f"Video ended early, at frame {frameIndex}")
+                break
+            frame = self.readBuffers.views[slot]
+            if self.sceneDetector is not None:
+                self.sceneDetector.process(frame)
+            self.readQueue.put(slot)
+        log("Ending Video Read")
+        if self.sceneDetector is not None:
+            self.sceneDetector.finish()
+        decoder.join()
+        self.readQueue.put(None)
+        self.readingDone = True
+
+    def readFrame(self):
+        """
+        Returns the next frame from the reader, a view into readBuffers, or None at the end of the video.
+        The frame has to be given back with releaseFrame once the render stage is done with it.
+        """
+        slot = self.readQueue.get()
+        if slot is None:
+            return None
+        return self.readBuffers.views[slot]
+
+    def releaseFrame(self, frame):
+        """
+        Gives a frame back to readBuffers, anything that is not a read buffer is ignored
+        """
+        if self.readBuffers is not None:
+            self.readBuffers.release(frame)
+
+    def retainFrame(self, frame):
+        """
+        Keeps a frame in its read buffer until it is released again, anything that is not a read buffer is ignored
+        """
+        if self.readBuffers is not None:
+            self.readBuffers.retain(frame)
+
+    def writeFrame(self, frame):
+        """
+        Queues a frame to be written, a source frame written out as is stays in its read buffer until the writer is done with it
+        """
+        self.retainFrame(frame)
+        self.writeQueue.put(frame)
+
     def returnFrame(self, frame):
         return frame
 
@@ -236,7 +613,10 @@ class FFMpegRender:
             if self.writingDone:
                 self.shm.close()
                 self.shm.unlink()
+                self.closeFrameRings()
+                self.reportQueues()
                 break
+            self.sampleQueues()
             if self.previewFrame is not None:
                 # print out data to stdout
                 fps = round(self.currentFrame / (time.time() - self.startTime))
@@ -244,10 +624,20 @@ class FFMpegRender:
                 self.realTimePrint(message)
                 if self.sharedMemoryID is not None:
                     # Update the shared array
-                    buffer[:fcs] = bytes(self.previewFrame)
+                    buffer[:fcs] = self.previewFrame
+                self.previewShown = True
 
             time.sleep(0.1)
 
+    def updatePreview(self, frame):
+        """
+        Copies a frame for the preview, before it goes back to its buffer, written frames are views into buffers that are reused.
+        Only one frame is copied each time the preview is shown, not every written frame.
+        """
+        if self.previewFrame is None or self.previewShown:
+            self.previewFrame = bytes(frame)
+            self.previewShown = False
+
     def writeOutVideoFrames(self):
         """
         Writes out frames either to ffmpeg or to pipe
@@ -265,11 +655,16 @@ class FFMpegRender:
             # pbar = tqdm(total=self.totalOutputFrames)
             while True:
                 frame = self.writeQueue.get()
-                self.previewFrame = frame
                 if frame is None:
                     break
+                self.updatePreview(frame)
+                self.releaseFrame(frame)
                 # pbar.update(1)
                 self.currentFrame += 1
+        elif self.checkpoint is not None:
+            self.writeOutVideoChunks()
+        elif self.processPipeline:
+            self.sendVideoFrames()
         else:
             self.writeProcess = subprocess.Popen(
                 self.getFFmpegWriteCommand(),
@@ -284,7 +679,8 @@ class FFMpegRender:
                     break
                 self.writeProcess.stdin.buffer.write(frame)
                 # Update other variables
-                self.previewFrame = frame
+                self.updatePreview(frame)
+                self.releaseFrame(frame)
                 # Update progress bar
                 # pbar.update(1)
                 self.currentFrame += 1
@@ -294,3 +690,158 @@ class FFMpegRender:
         renderTime = time.time() - self.startTime
         self.writingDone = True
         printAndLog(f"\nTime to complete render: {round(renderTime, 2)}")
+
+    def sendVideoFrames(self):
+        """
+        Starts the encoder process, and copies every frame into a slot of the shared writeBuffers for it.
+        The copy is the only work left in this process, ffmpeg is fed by the encoder process.
+        """
+        self.writeBuffers = SharedFrameRing(
+            self.outputFrameChunkSize,
+            self.writeQueue.maxsize + EXTRA_WRITE_BUFFERS,
+            self.processContext,
+        )
+        encoder = self.processContext.Process(
+            target=encodeFrames,
+            args=(self.getFFmpegWriteCommand(), self.writeBuffers.getAttachArgs()),
+        )
+        encoder.start()
+        while True:
+            frame = self.writeQueue.get()
+            if frame is None:
+                self.writeBuffers.publishEndOfStream(self.currentFrame)
+                break
+            slot = self.acquireWriteSlot(encoder)
+            view = self.writeBuffers.views[slot]
+            view[:] = memoryview(frame).cast("B")
+            self.updatePreview(frame)
+            self.releaseFrame(frame)
+            self.writeBuffers.publish(slot, self.currentFrame, len(view))
+            self.currentFrame += 1
+        encoder.join()
+        if encoder.exitcode != 0:
+            raise os.error("FFmpeg failed to write the video")
+
+    def acquireWriteSlot(self, encoder) -> int:
+        """
+        Waits for a free slot of writeBuffers, if the encoder process has died no slot is ever freed again.
+        """
+        while True:
+            try:
+                return self.writeBuffers.acquire(timeout=ENCODER_POLL_SECONDS)
+            except queue.Empty:
+                if not encoder.is_alive():
+                    raise os.error("FFmpeg failed to write the video")
+
+    def closeFrameRings(self):
+        """
+        Removes the shared memory of a process pipeline, once the decoder and encoder processes have exited
+        """
+        for ring in (self.readBuffers, self.writeBuffers):
+            if isinstance(ring, SharedFrameRing):
+                ring.close()
+
+    def writeOutVideoChunks(self):
+        """
+        Writes out frames to a new ffmpeg process every checkpoint.chunkSize input frames.
+        Once ffmpeg has finished a chunk, it is marked as complete in the checkpoint, so a crashed render can pick up after it.
+        When every frame is written, the chunks are joined into the output file.
+        """
+        chunk = self.startFrame // self.checkpoint.chunkSize
+        framesPerChunk = self.getOutputFramesInChunk(chunk)
+        framesInChunk = 0
+        self.writeProcess = None
+        while True:
+            frame = self.writeQueue.get()
+
+            if frame is None:
+                break
+            if self.writeProcess is None:
+                self.writeProcess = subprocess.Popen(
+                    self.getFFmpegWriteCommand(
+                        outputFile=self.checkpoint.chunkPath(chunk), overwrite=True
+                    ),
+                    stdin=subprocess.PIPE,
+                )
+            self.writeProcess.stdin.write(frame)
+            self.updatePreview(frame)
+            self.releaseFrame(frame)
+            self.currentFrame += 1
+            framesInChunk += 1
+            if framesInChunk == framesPerChunk:
+                self.finishChunk(chunk, framesInChunk)
+                chunk += 1
+                framesInChunk = 0
+                framesPerChunk = self.getOutputFramesInChunk(chunk)
+        if self.writeProcess is not None:
+            self.finishChunk(chunk, framesInChunk)
+        self.checkpoint.stitch(
+            self.outputFile, audioFile=self.inputFile, overwrite=self.overwrite
+        )
+
+    def getOutputFramesInChunk(self, chunk: int) -> int:
+        startFrame = chunk * self.checkpoint.chunkSize
+        return self.timestepScheduler.outputFramesBefore(
+            startFrame + self.checkpoint.chunkSize
+        ) - self.timestepScheduler.outputFramesBefore(startFrame)
+
+    def finishChunk(self, chunk: int, framesInChunk: int):
+        self.writeProcess.stdin.close()
+        self.writeProcess.wait()
+        if self.writeProcess.returncode != 0:
+            raise os.error(f"FFmpeg failed to write chunk {chunk}")
+        startFrame = chunk * self.checkpoint.chunkSize
+        if framesInChunk == self.getOutputFramesInChunk(chunk):
+            endFrame = startFrame + self.checkpoint.chunkSize
+        else:
+            # the last chunk is cut short by the end of the video
+            endFrame = startFrame + math.ceil(framesInChunk / self.interpolateFactor)
+        self.checkpoint.markComplete(chunk, startFrame, endFrame)
+        self.writeProcess = None
+
+
+def concatVideos(
+    inputFiles: list[str],
+    outputFile: str,
+    audioFile: str = None,
+    overwrite: bool = False,
+):
+    """
+    Joins videos that were encoded with the same settings using ffmpeg's concat demuxer, without re-encoding.
+    If audioFile is set, its audio is muxed into the output once.
+    """
+    listFile = os.path.join(os.path.dirname(inputFiles[0]), "concat.txt")
+    with open(listFile, "w") as f:
+        for inputFile in inputFiles:
+            escapedPath = os.path.abspath(inputFile).replace("'", "'\\''")
+            f.write(f"file '{escapedPath}'\n")
+
+    command = [
+        f"{os.path.join(currentDirectory(),'bin','ffmpeg')}",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        listFile,
+    ]
+    if audioFile is not None:
+        command += [
+            "-i",
+            audioFile,
+            "-map",
+            "0:v",
+            "-map",
+            "1:a?",
+        ]
+    command += [
+        "-c",
+        "copy",
+        "-loglevel",
+        "error",
+    ]
+    if overwrite:
+        command.append("-y")
+    command.append(outputFile)
+    log("Joining videos: " + " ".join(command))
+    subprocess.run(command, check=True)
@@ -0,0 +1,63 @@
+import queue
+import threading
+
+
+class FrameBufferRing:
+    """
+    A fixed set of frame buffers that are reused for the whole render, ffmpeg reads straight into them so no frame is allocated per frame.
+    Buffers are handed out by slot index, and go back on the free list once every user of the frame has released it.
+    The slot starts with one reference held by the render stage, a frame that is also written out as is, is retained until the writer is done with it.
+
+    Args:
+        frameSize (int): The size of a frame in bytes.
+        slots (int): The number of frames, this has to cover every frame that can be queued at once, or the reader waits on the render.
+    """
+
+    def __init__(self, frameSize: int, slots: int):
+        self.frameSize = frameSize
+        self.buffer = bytearray(frameSize * slots)
+        bufferView = memoryview(self.buffer)
+        # the views live as long as the ring, so their ids are only ever used by them
+        self.views = [
+            bufferView[slot * frameSize : (slot + 1) * frameSize]
+            for slot in range(slots)
+        ]
+        self.slotOfView = {id(view): slot for slot, view in enumerate(self.views)}
+        self.references = [0] * slots
+        self.lock = threading.Lock()
+        # last in first out, so the same few buffers stay in use while the render keeps up with the reader
+        self.freeSlots = queue.LifoQueue()
+        for slot in range(slots):
+            self.freeSlots.put(slot)
+
+    def acquire(self) -> int:
+        """
+        Waits for a free slot, and returns it with one reference held by the caller
+        """
+        slot = self.freeSlots.get()
+        with self.lock:
+            self.references[slot] = 1
+        return slot
+
+    def getSlot(self, frame) -> int:
+        """
+        Returns the slot of a view from this ring, or None for any other frame
+        """
+        return self.slotOfView.get(id(frame))
+
+    def retain(self, frame):
+        slot = self.getSlot(frame)
+        if slot is None:
+            return
+        with self.lock:
+            self.references[slot] += 1
+
+    def release(self, frame):
+        slot = self.getSlot(frame)
+        if slot is None:
+            return
+        with self.lock:
+            self.references[slot] -= 1
+            free = self.references[slot] == 0
+        if free:
+            self.freeSlots.put(slot)
@@ -160,27 +160,57 @@ class IFNet(nn.Module):
         # self.contextnet = Contextnet()
         # self.unet = Unet()
 
-    def forward(self, img0, img1, timestep):
-        # cant be cached
+    def forward(
+        self,
+        img0,
+        img1,
+        timestep,
+        f0=None,
+        f1=None,
+        returnFlows=False,
+        initFlows=None,
+        initMask=None,
+    ):
+        # f0 and f1 are the encoded frames, when the caller kept them from an earlier pair
+        # initFlows and initMask are the flows and the mask before the sigmoid of an earlier pair, to start from instead of the first block
         h, w = img0.shape[2], img0.shape[3]
+        # a batch of pairs, or one pair with a batch of timesteps, the encoder runs once for each pair
+        n = max(img0.shape[0], timestep.shape[0])
         imgs = torch.cat([img0, img1], dim=1)
-        imgs_2 = torch.reshape(imgs, (2, 3, h, w))
-        fs_2 = self.encode(imgs_2)
-        fs = torch.reshape(fs_2, (1, 16, h, w))
+        if f0 is None or f1 is None:
+            fs = torch.reshape(
+                self.encode(torch.reshape(imgs, (-1, 3, h, w))), (-1, 16, h, w)
+            )
+        else:
+            fs = torch.cat([f0, f1], dim=1)
+        imgs = imgs.expand(n, -1, -1, -1)
+        fs = fs.expand(n, -1, -1, -1)
+        timestep = timestep.expand(n, -1, -1, -1)
+        imgs_2 = torch.reshape(imgs, (2 * n, 3, h, w))
+        fs_2 = torch.reshape(fs, (2 * n, 8, h, w))
         if self.ensemble:
             fs_rev = torch.cat(torch.split(fs, [8, 8], dim=1)[::-1], dim=1)
-            imgs_rev = torch.cat([img1, img0], dim=1)
+            imgs_rev = torch.cat(torch.split(imgs, [3, 3], dim=1)[::-1], dim=1)
 
         flows = None
         mask = None
         blocks = [self.block0, self.block1, self.block2, self.block3]
         for block, scale in zip(blocks, self.scale_list):
-            if flows is None:
+            if flows is None and initFlows is not None:
+                # warm started from the flow of the previous pair, in place of the first block
+                flows = initFlows
+                mask = initMask
+                if self.ensemble:
+                    flows_rev = torch.cat(
+                        torch.split(flows, [2, 2], dim=1)[::-1], dim=1
+                    )
+            elif flows is None:
                 if self.ensemble:
+                    temp = torch.cat((imgs, fs, timestep), 1)
                     temp_ = torch.cat((imgs_rev, fs_rev, 1 - timestep), 1)
                     flowss, masks = block(torch.cat((temp, temp_), 0), scale=scale)
-                    flows, flows_ = torch.split(flowss, [1, 1], dim=0)
-                    mask, mask_ = torch.split(masks, [1, 1], dim=0)
+                    flows, flows_ = torch.split(flowss, [n, n], dim=0)
+                    mask, mask_ = torch.split(masks, [n, n], dim=0)
                     flows = (
                         flows
                         + torch.cat(torch.split(flows_, [2, 2], dim=1)[::-1], dim=1)
@@ -216,8 +246,8 @@ class IFNet(nn.Module):
                         1,
                     )
                     fdss, masks = block(torch.cat((temp, temp_), 0), scale=scale)
-                    fds, fds_ = torch.split(fdss, [1, 1], dim=0)
-                    mask, mask_ = torch.split(masks, [1, 1], dim=0)
+                    fds, fds_ = torch.split(fdss, [n, n], dim=0)
+                    mask, mask_ = torch.split(masks, [n, n], dim=0)
                     fds = (
                         fds + torch.cat(torch.split(fds_, [2, 2], dim=1)[::-1], dim=1)
                     ) / 2
@@ -242,11 +272,15 @@ class IFNet(nn.Module):
                         torch.split(flows, [2, 2], dim=1)[::-1], dim=1
                     )
             precomp = (
-                (self.backwarp_tenGrid + flows.reshape((2, 2, h, w)) * self.tenFlow_div)
+                (
+                    self.backwarp_tenGrid
+                    + flows.reshape((2 * n, 2, h, w)) * self.tenFlow_div
+                )
                 .permute(0, 2, 3, 1)
                 .to(dtype=self.dtype)
             )
-            if scale == 1:
+            # the last block, its scale is not 1 when the flow is estimated at a lower resolution
+            if scale == self.scale_list[-1]:
                 warped_imgs = torch.nn.functional.grid_sample(
                     imgs_2,
                     precomp,
@@ -265,14 +299,21 @@ class IFNet(nn.Module):
                     align_corners=True,
                 )
                 wimg, wf = torch.split(warps, [3, 8], dim=1)
-                wimg = torch.reshape(wimg, (1, 6, h, w))
-                wf = torch.reshape(wf, (1, 16, h, w))
+                wimg = torch.reshape(wimg, (n, 6, h, w))
+                wf = torch.reshape(wf, (n, 16, h, w))
                 if self.ensemble:
                     wimg_rev = torch.cat(torch.split(wimg, [3, 3], dim=1)[::-1], dim=1)
                     wf_rev = torch.cat(torch.split(wf, [8, 8], dim=1)[::-1], dim=1)
         mask = torch.sigmoid(mask)
-        warped_img0, warped_img1 = torch.split(warped_imgs, [1, 1])
+        warped_img0, warped_img1 = torch.split(
+            torch.reshape(warped_imgs, (n, 6, h, w)), [3, 3], dim=1
+        )
 
         frame = warped_img0 * mask + warped_img1 * (1 - mask)
-        frame = frame[:, :, : self.height, : self.width][0]
-        return frame.squeeze(0).permute(1, 2, 0).mul(255).float()
+        frame = frame[:, :, : self.height, : self.width]
+        # a single frame is returned as (H, W, 3), a batch as (N, H, W, 3)
+        frame = frame.permute(0, 2, 3, 1).mul(255).float().squeeze(0)
+        if returnFlows:
+            # the padded (N, 4, H, W) flows to frame0 and frame1 in pixels, and the (N, 1, H, W) blend mask
+            return frame, flows, mask
+        return frame
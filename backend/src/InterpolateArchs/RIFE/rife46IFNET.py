@@ -119,14 +119,26 @@ class IFNet(nn.Module):
         self.backwarp_tenGrid = backwarp_tenGrid
         self.tenFlow_div = tenFlow_div
 
-    def forward(self, img0, img1, timestep):
+    def forward(
+        self, img0, img1, timestep, returnFlows=False, initFlows=None, initMask=None
+    ):
+        # initFlows and initMask are the flows and the mask before the sigmoid of an earlier pair, to start from instead of the first block
+        # a batch of pairs, or one pair with a batch of timesteps
+        n = max(img0.shape[0], timestep.shape[0])
+        img0 = img0.expand(n, -1, -1, -1)
+        img1 = img1.expand(n, -1, -1, -1)
+        timestep = timestep.expand(n, -1, -1, -1)
         warped_img0 = img0
         warped_img1 = img1
         flow = None
         mask = None
         block = [self.block0, self.block1, self.block2, self.block3]
         for i in range(4):
-            if flow is None:
+            if flow is None and initFlows is not None:
+                # warm started from the flow of the previous pair, in place of the first block
+                flow = initFlows
+                mask = initMask
+            elif flow is None:
                 flow, mask = block[i](
                     torch.cat((img0[:, :3], img1[:, :3], timestep), 1),
                     None,
@@ -176,5 +188,10 @@ class IFNet(nn.Module):
 
         temp = torch.sigmoid(latest_mask)
         frame = warped_img0 * temp + warped_img1 * (1 - temp)
-        frame = frame[:, :, : self.height, : self.width][0]
-        return frame.squeeze(0).permute(1, 2, 0).mul(255).float()
\ No newline at end of file
+        frame = frame[:, :, : self.height, : self.width]
+        # a single frame is returned as (H, W, 3), a batch as (N, H, W, 3)
+        frame = frame.permute(0, 2, 3, 1).mul(255).float().squeeze(0)
+        if returnFlows:
+            # the padded (N, 4, H, W) flows to frame0 and frame1 in pixels, and the (N, 1, H, W) blend mask
+            return frame, flow, temp
+        return frame
\ No newline at end of file
@@ -9,6 +9,7 @@ class InterpolateRIFENCNN:
         height: int = 1080,
         threads: int = 1,
         gpuid: int = 0,
+        uhdMode: bool = False,
     ):
         self.interpolateModelPath = interpolateModelPath
         self.width = width
@@ -17,7 +18,7 @@ class InterpolateRIFENCNN:
             gpuid=gpuid,
             num_threads=threads,
             model=self.interpolateModelPath,
-            uhd_mode=False,
+            uhd_mode=uhdMode,
             channels=3,
             height=height,
             width=width,
@@ -1,8 +1,10 @@
 import torch
 import torch.nn.functional as F
 from .InterpolateArchs.DetectInterpolateArch import ArchDetect
+import inspect
 import math
 import os
+import threading
 from .Util import (
     currentDirectory,
     printAndLog,
@@ -10,10 +12,29 @@ from .Util import (
     modelsDirectory,
     check_bfloat16_support,
 )
+from .SharedWeights import loadSharedWeights
+from .StagePlanner import getFlowScale
 
 torch.set_float32_matmul_precision("high")
 torch.set_grad_enabled(False)
 
+# the most timesteps that go through the flownet at once, more are split into several forwards to bound the memory
+MAX_TIMESTEP_BATCH = 8
+# mean change in pixels of a warm started flow, above which the pair is interpolated again from the first block
+WARM_START_MAX_RESIDUAL = 2.0
+
+
+def getIFNetStateDict(interpolateModelPath: str, device="cpu") -> dict:
+    """
+    Loads the weights of a rife model, with the keys of the IFNet they are loaded into
+    """
+    state_dict = torch.load(
+        interpolateModelPath, map_location=device, weights_only=True, mmap=True
+    )
+    return {
+        k.replace("module.", ""): v for k, v in state_dict.items() if "module." in k
+    }
+
 
 class InterpolateRifeTorch:
     """InterpolateRifeTorch class for video interpolation using RIFE model in PyTorch.
@@ -26,23 +47,43 @@ class InterpolateRifeTorch:
         device (str, optional): Device to use for computation. Defaults to "default".
         dtype (str, optional): Data type to use for computation. Defaults to "auto".
         backend (str, optional): Backend to use for computation. Defaults to "pytorch".
-        UHDMode (bool, optional): Flag to enable UHD mode. Defaults to False.
+        UHDMode (bool, optional): Flag to enable UHD mode, the same as a flowScale of 0.5. Defaults to False.
         ensemble (bool, optional): Flag to enable ensemble mode. Defaults to False.
         trt_workspace_size (int, optional): Workspace size for TensorRT optimization. Defaults to 0.
         trt_max_aux_streams (int | None, optional): Maximum auxiliary streams for TensorRT optimization. Defaults to None.
         trt_optimization_level (int, optional): Optimization level for TensorRT optimization. Defaults to 5.
         trt_cache_dir (str, optional): Directory to cache TensorRT engine files. Defaults to modelsDirectory().
         trt_debug (bool, optional): Flag to enable TensorRT debug mode. Defaults to False.
+        stagingBuffers (int, optional): The number of padded input tensors frame_to_tensor reuses, this has to cover every set up frame that is alive at once. Defaults to 3.
+        sharedWeights (str, optional): Weights written by writeSharedWeights, mapped instead of loading the model file, so processes share them. Defaults to None.
+        flowScale (float | str, optional): The resolution the flow is estimated at, 1, 0.5, 0.25, or auto to pick it with getFlowScale. Defaults to 1.0.
+        warmStart (bool, optional): Starts the flow of a pair from the flow of the pair before it, instead of the first block, pytorch backend only.
+            Pairs have to be interpolated in order, from a single thread. Defaults to False.
 
     Methods:
         process(img0, img1, timestep):
             Processes the input frames and returns the interpolated frame.
 
+        processOnDevice(img0, img1, timestep):
+            Processes the input frames and returns the interpolated frame on the device, to be converted with tensor_to_frame.
+
+        processToTensor(img0, img1, timestep):
+            Processes the input frames and returns the interpolated frame as a tensor on the device.
+
+        processBatchOnDevice(img0, img1, timesteps), processBatchToTensor(img0, img1, timesteps):
+            Same as processOnDevice and processToTensor, for every timestep between the input frames in one forward.
+
+        flowMagnitude(img0, img1):
+            Returns the mean length in pixels of the flow between the input frames.
+
+        blendOnDevice(img0, img1, timestep), blendToTensor(img0, img1, timestep):
+            Same as processOnDevice and processToTensor, with a linear blend of the input frames instead of the model.
+
         tensor_to_frame(frame):
             Converts a tensor to a frame for rendering.
 
         frame_to_tensor(frame):
-            Converts a frame to a tensor for processing.
+            Converts a frame to a tensor for processing, filling in the next padded tensor of the staging pool.
     def __init__(self, interpolateModelPath, interpolateArch="rife413", width=1920, height=1080, device="default", dtype="auto", backend="pytorch", UHDMode=False, ensemble=False, trt_workspace_size=0, trt_max_aux_streams=None, trt_optimization_level=5, trt_cache_dir=modelsDirectory(), trt_debug=False):
         pass
 
@@ -81,7 +122,6 @@ class InterpolateRifeTorch:
     def __init__(
         self,
         interpolateModelPath: str,
-        ceilInterpolateFactor: int = 2,
         width: int = 1920,
         height: int = 1080,
         device: str = "default",
@@ -95,6 +135,10 @@ class InterpolateRifeTorch:
         trt_optimization_level: int = 5,
         trt_cache_dir: str = modelsDirectory(),
         trt_debug: bool = False,
+        stagingBuffers: int = 3,
+        sharedWeights: str = None,
+        flowScale: float | str = 1.0,
+        warmStart: bool = False,
     ):
         if device == "default":
             if torch.cuda.is_available():
@@ -114,32 +158,46 @@ class InterpolateRifeTorch:
         self.device = device
         self.dtype = self.handlePrecision(dtype)
         self.backend = backend
-        self.ceilInterpolateFactor = ceilInterpolateFactor
         # set up streams for async processing
         self.stream = torch.cuda.Stream()
         self.prepareStream = torch.cuda.Stream()
-        scale = 1
+        scale = getFlowScale(width, height, flowScale)
         if UHDMode:
             scale = 0.5
+        if scale != 1:
+            printAndLog(f"Estimating flow at {scale}x resolution")
         with torch.cuda.stream(self.prepareStream):
-            state_dict = torch.load(
-                interpolateModelPath, map_location=self.device, weights_only=True, mmap=True
-            )
+            if sharedWeights is None:
+                state_dict = getIFNetStateDict(interpolateModelPath, self.device)
+            else:
+                # written once by the process that started this one, every process maps the same weights
+                state_dict = loadSharedWeights(sharedWeights)
 
             tmp = max(32, int(32 / scale))
             self.pw = math.ceil(self.width / tmp) * tmp
             self.ph = math.ceil(self.height / tmp) * tmp
             self.padding = (0, self.pw - self.width, 0, self.ph - self.height)
+            # set up frames are written into these in place, the padding is zeroed here and never written to
+            self.stagingFrames = [
+                torch.zeros((1, 3, self.ph, self.pw), dtype=self.dtype, device=device)
+                for _ in range(max(1, stagingBuffers))
+            ]
+            self.stagingIndex = 0
+            # when upscaling first, frames are set up in the render threads, so the pool is handed out under a lock
+            self.stagingLock = threading.Lock()
+            # the number of frames set up so far, and the index each staging tensor got when its frame was set up
+            self.stagedFrames = 0
+            self.stagingFrameIndices = {}
+            # frames are copied to the device as uint8 first, which is smaller than the converted frame
+            self.uploadFrame = None
+            if torch.device(device).type != "cpu":
+                self.uploadFrame = torch.empty(
+                    (self.height, self.width, 3), dtype=torch.uint8, device=device
+                )
             ad = ArchDetect(interpolateModelPath)
             interpolateArch = ad.getArch()
-            # caching the timestep tensor in a dict with the timestep as a float for the key
+            # caching the timestep tensor in a dict with the timestep as a float for the key, filled in by getTimestepTensor
             self.timestepDict = {}
-            for n in range(self.ceilInterpolateFactor):
-                    timestep = 1 / (self.ceilInterpolateFactor - n)
-                    timestep_tens = torch.full(
-                        (1, 1, self.ph, self.pw), timestep, dtype=self.dtype, device=self.device
-                    )
-                    self.timestepDict[timestep] = timestep_tens
             # detect what rife arch to use
             match interpolateArch.lower():
                 case "rife46":
@@ -222,10 +280,10 @@ class InterpolateRifeTorch:
                 tenFlow_div=self.tenFlow_div,
             )
 
-            state_dict = {
-                k.replace("module.", ""): v for k, v in state_dict.items() if "module." in k
-            }
-            self.flownet.load_state_dict(state_dict=state_dict, strict=False)
+            # shared weights are already in self.dtype, assigning them keeps them in the pages every process shares
+            self.flownet.load_state_dict(
+                state_dict=state_dict, strict=False, assign=sharedWeights is not None
+            )
             self.flownet.eval().to(device=self.device, dtype=self.dtype)
 
             if self.backend == "tensorrt":
@@ -289,6 +347,30 @@ class InterpolateRifeTorch:
 
                 self.flownet = torch.export.load(trt_engine_path).module()
 
+            # frame1 of a pair is frame0 of the next one, so its encoded features are kept, filled in by encodeFrames
+            # they are keyed by the staging tensor, and dropped once nextStagingFrame hands that tensor out again
+            self.encodedFrames = {}
+            # the compiled engines and rife 4.6 take no encoded frames
+            self.cacheEncodedFrames = self.backend == "pytorch" and hasattr(
+                self.flownet, "encode"
+            )
+            # (timesteps, flows, mask) of the pairs that can still warm start the next one, by the index of the pair
+            self.warmStarts = {}
+            # filled in by getUpscaledGrid, for the frames processUpscaledBatch warps
+            self.upscaledGrids = {}
+            self.warmStartedPairs = 0
+            self.coldStartedPairs = 0
+            # rife 4.21 and 4.22 lite feed features of the first block to the next ones, so it can not be skipped
+            self.warmStart = (
+                warmStart
+                and self.backend == "pytorch"
+                and "initFlows" in inspect.signature(self.flownet.forward).parameters
+            )
+            if warmStart and not self.warmStart:
+                printAndLog(
+                    "Warm starting the flow needs the pytorch backend, and a rife model before 4.21, every pair starts from the first block"
+                )
+
     def handlePrecision(self, precision):
         if precision == "auto":
             return torch.float16 if check_bfloat16_support() else torch.float32
@@ -297,16 +379,391 @@ class InterpolateRifeTorch:
         if precision == "float16":
             return torch.float16
 
+    @torch.inference_mode()
+    def getTimestepTensor(self, timestep: float) -> torch.Tensor:
+        """
+        Creates the timestep tensor the first time a timestep is used, and caches it
+        """
+        timestep_tens = self.timestepDict.get(timestep)
+        if timestep_tens is None:
+            timestep_tens = torch.full(
+                (1, 1, self.ph, self.pw), timestep, dtype=self.dtype, device=self.device
+            )
+            self.timestepDict[timestep] = timestep_tens
+        return timestep_tens
+
+    def encodeFrame(self, frame: torch.Tensor) -> torch.Tensor:
+        """
+        Returns the encoded features of a set up frame, encoding it only the first time it is seen.
+        Only frames in the staging pool of this instance are kept, as only those are dropped once they are overwritten.
+        """
+        cached = self.encodedFrames.get(id(frame))
+        if cached is not None and cached[0] is frame:
+            return cached[1]
+        features = self.flownet.encode(frame)
+        if any(frame is staging for staging in self.stagingFrames):
+            self.encodedFrames[id(frame)] = (frame, features)
+        return features
+
+    def runFlownet(self, img0, img1, timesteps: list, returnFlows: bool = False):
+        """
+        Runs the flownet on the stream it is called in, for every timestep in one forward.
+        The encoded frames of earlier pairs are used when they are cached, and the flow is warm started when it is enabled.
+        With returnFlows, the flows and the mask are returned after the frames, like the pytorch IFNet does.
+        """
+        timestep = torch.cat([self.getTimestepTensor(t) for t in timesteps])
+        args = (img0, img1, timestep)
+        if self.cacheEncodedFrames:
+            args += (self.encodeFrame(img0), self.encodeFrame(img1))
+        if not self.warmStart:
+            return self.flownet(*args, returnFlows=returnFlows)
+
+        # a pair is numbered by the index frame0 was set up with, so only the pair right before it is used to warm start it
+        pairIndex = self.getStagingFrameIndex(img0)
+        if pairIndex is None:
+            return self.flownet(*args, returnFlows=returnFlows)
+        previous = self.warmStarts.get(pairIndex - 1)
+        initial = None
+        if previous is not None:
+            initial = self.getWarmStart(previous, timesteps)
+        if initial is not None:
+            initFlows, initMask = initial
+            output, flows, mask = self.flownet(
+                *args,
+                returnFlows=True,
+                initFlows=initFlows,
+                initMask=torch.logit(initMask, eps=1e-6),
+            )
+            # the motion changed too much from the last pair for the coarse blocks to be skipped
+            if (flows - initFlows).abs().mean().item() > WARM_START_MAX_RESIDUAL:
+                initial = None
+            else:
+                self.warmStartedPairs += 1
+        if initial is None:
+            output, flows, mask = self.flownet(*args, returnFlows=True)
+            self.coldStartedPairs += 1
+        # the timesteps of a pair can be split over several forwards
+        current = self.warmStarts.get(pairIndex)
+        if current is None:
+            current = (list(timesteps), flows, mask)
+        else:
+            current = (
+                current[0] + list(timesteps),
+                torch.cat((current[1], flows)),
+                torch.cat((current[2], mask)),
+            )
+        self.warmStarts = {pairIndex: current}
+        if previous is not None:
+            # the pair before is kept until every forward of this pair has run
+            self.warmStarts[pairIndex - 1] = previous
+        if returnFlows:
+            return output, flows, mask
+        return output
+
+    def getStagingFrameIndex(self, frame):
+        """
+        Returns the index frame was set up with, None if it is not a frame of the staging pool
+        """
+        staged = self.stagingFrameIndices.get(id(frame))
+        if staged is None or staged[0] is not frame:
+            return None
+        return staged[1]
+
+    def getWarmStart(self, previous: tuple, timesteps: list):
+        """
+        Returns the flows and the mask of the previous pair at each of the timesteps, from the nearest timestep the previous pair was interpolated at.
+        The flows are from the timestep to each frame, so they are scaled by how far the timestep is from each frame, as if the motion was linear.
+        """
+        previousTimesteps, flows, mask = previous
+        nearest = [
+            min(
+                range(len(previousTimesteps)),
+                key=lambda index: abs(previousTimesteps[index] - timestep),
+            )
+            for timestep in timesteps
+        ]
+        scales = []
+        for timestep, index in zip(timesteps, nearest):
+            previousTimestep = previousTimesteps[index]
+            if previousTimestep <= 0 or previousTimestep >= 1:
+                return None
+            scale0 = timestep / previousTimestep
+            scale1 = (1 - timestep) / (1 - previousTimestep)
+            scales.append((scale0, scale0, scale1, scale1))
+        indices = torch.tensor(nearest, device=flows.device)
+        scales = torch.tensor(scales, dtype=flows.dtype, device=flows.device)
+        return (
+            flows.index_select(0, indices) * scales[:, :, None, None],
+            mask.index_select(0, indices),
+        )
+
+    def reportWarmStarts(self):
+        if not self.warmStart:
+            return
+        totalPairs = max(1, self.warmStartedPairs + self.coldStartedPairs)
+        printAndLog(
+            f"Warm started the flow of {self.warmStartedPairs} of {totalPairs} model calls "
+            + f"({round(100 * self.warmStartedPairs / totalPairs, 1)}%)"
+        )
+
+    def uncacheFrame(self, frame=None):
+        """
+        Drops every encoded frame and warm start, called at a scene change, where the frame after it does not follow on from it
+        """
+        self.encodedFrames.clear()
+        self.warmStarts.clear()
+
     @torch.inference_mode()
     def process(self, img0, img1, timestep):
         with torch.cuda.stream(self.stream):
-            
-            timestep = self.timestepDict[timestep]
-            output = self.flownet(img0, img1, timestep)
+            output = self.runFlownet(img0, img1, [timestep])
             output = self.tensor_to_frame(output)
         self.stream.synchronize()
         return output
 
+    @torch.inference_mode()
+    def processOnDevice(self, img0, img1, timestep) -> torch.Tensor:
+        """
+        Interpolates a frame like process, but leaves it on the device, so another thread can convert it with tensor_to_frame
+        """
+        with torch.cuda.stream(self.stream):
+            output = self.runFlownet(img0, img1, [timestep])
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def processToTensor(self, img0, img1, timestep) -> torch.Tensor:
+        """
+        Interpolates a frame, and keeps it on the device as a (1, 3, H, W) tensor in the 0-1 range, so another model can run on it
+        """
+        with torch.cuda.stream(self.stream):
+            output = self.runFlownet(img0, img1, [timestep])
+            output = output.permute(2, 0, 1).unsqueeze(0).div(255.0).to(self.dtype)
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def processTimesteps(self, img0, img1, timesteps: list) -> torch.Tensor:
+        """
+        Interpolates every timestep between a pair of frames in one forward, the frames are only encoded once.
+        Returns a (N, H, W, 3) tensor on the device, in the order of the timesteps.
+        The tensorrt engines are built for one timestep, so they run a forward per timestep.
+        """
+        if self.backend == "tensorrt" or len(timesteps) == 1:
+            return torch.stack(
+                [self.processOnDevice(img0, img1, timestep) for timestep in timesteps]
+            )
+        outputs = []
+        with torch.cuda.stream(self.stream):
+            for start in range(0, len(timesteps), MAX_TIMESTEP_BATCH):
+                outputs.append(
+                    self.runFlownet(
+                        img0, img1, timesteps[start : start + MAX_TIMESTEP_BATCH]
+                    ).reshape(-1, self.height, self.width, 3)
+                )
+            output = torch.cat(outputs)
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def processBatchOnDevice(self, img0, img1, timesteps: list) -> list:
+        """
+        processOnDevice for every timestep between a pair of frames, with one forward for all of them
+        """
+        return list(self.processTimesteps(img0, img1, timesteps).unbind(0))
+
+    @torch.inference_mode()
+    def processBatchToTensor(self, img0, img1, timesteps: list) -> list:
+        """
+        processToTensor for every timestep between a pair of frames, with one forward for all of them
+        """
+        with torch.cuda.stream(self.stream):
+            output = (
+                self.processTimesteps(img0, img1, timesteps)
+                .permute(0, 3, 1, 2)
+                .div(255.0)
+                .to(self.dtype)
+            )
+        self.stream.synchronize()
+        return list(output.split(1))
+
+    @torch.inference_mode()
+    def flowMagnitude(self, img0, img1) -> float:
+        """
+        Returns the mean length in pixels of the flow from the middle of the frames to each of them, a measure of how much the pair moves
+        """
+        with torch.cuda.stream(self.stream):
+            _, flows, _ = self.flownet(
+                img0, img1, self.getTimestepTensor(0.5), returnFlows=True
+            )
+            flows = flows[:, :, : self.height, : self.width]
+            magnitude = torch.cat(flows.split(2, dim=1)).float().norm(dim=1).mean()
+        self.stream.synchronize()
+        return magnitude.item()
+
+    @torch.inference_mode()
+    def blendOnDevice(self, img0, img1, timestep: float) -> torch.Tensor:
+        """
+        Blends the frames linearly instead of interpolating them, for pairs that barely move, the output matches processOnDevice
+        """
+        with torch.cuda.stream(self.stream):
+            output = (
+                torch.lerp(img0, img1, timestep)[0, :, : self.height, : self.width]
+                .permute(1, 2, 0)
+                .mul(255)
+                .float()
+                # tensor_to_frame truncates, a pixel that does not change has to come out the same
+                .round()
+            )
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def blendToTensor(self, img0, img1, timestep: float) -> torch.Tensor:
+        """
+        Blends the frames like blendOnDevice, the output matches processToTensor
+        """
+        with torch.cuda.stream(self.stream):
+            output = torch.lerp(img0, img1, timestep)[
+                :, :, : self.height, : self.width
+            ].contiguous()
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def processUpscaledBatch(
+        self, img0, img1, timesteps: list, upscaled0, upscaled1
+    ) -> list:
+        """
+        Interpolates every timestep between upscaled0 and upscaled1, the upscaled copies of the set up img0 and img1, pytorch backend only.
+        The flow and the mask are estimated between img0 and img1 at the resolution of this model, upsampled to the upscaled frames,
+        and the upscaled frames are warped with them, so the flow is never estimated at the upscaled resolution.
+        Returns a (1, 3, H, W) tensor on the device for each timestep, like the upscaling model does.
+        """
+        outputs = []
+        with torch.cuda.stream(self.stream):
+            for start in range(0, len(timesteps), MAX_TIMESTEP_BATCH):
+                _, flows, mask = self.runFlownet(
+                    img0,
+                    img1,
+                    timesteps[start : start + MAX_TIMESTEP_BATCH],
+                    returnFlows=True,
+                )
+                outputs.append(self.warpUpscaled(flows, mask, upscaled0, upscaled1))
+            output = torch.cat(outputs)
+        self.stream.synchronize()
+        return list(output.split(1))
+
+    def warpUpscaled(self, flows, mask, upscaled0, upscaled1) -> torch.Tensor:
+        """
+        Warps the upscaled frames with the (N, 4, H, W) padded flows and the (N, 1, H, W) mask of the flownet, and blends them like IFNet.
+        The flows are in pixels of this model, so they are scaled with the frames, then normalized to the grid of the upscaled frames.
+        """
+        n = flows.shape[0]
+        height, width = upscaled0.shape[2], upscaled0.shape[3]
+        flows = F.interpolate(
+            flows[:, :, : self.height, : self.width],
+            size=(height, width),
+            mode="bilinear",
+            align_corners=False,
+        ) * (width / self.width)
+        mask = F.interpolate(
+            mask[:, :, : self.height, : self.width],
+            size=(height, width),
+            mode="bilinear",
+            align_corners=False,
+        )
+        backwarpGrid, flowDiv = self.getUpscaledGrid(height, width)
+        grid = (
+            (backwarpGrid + flows.reshape(2 * n, 2, height, width) * flowDiv)
+            .permute(0, 2, 3, 1)
+            .to(dtype=self.dtype)
+        )
+        # the flows of each timestep are to frame0 then frame1
+        imgs = torch.cat([upscaled0, upscaled1]).to(dtype=self.dtype).repeat(n, 1, 1, 1)
+        warped = torch.nn.functional.grid_sample(
+            imgs,
+            grid,
+            mode="bilinear",
+            padding_mode="border",
+            align_corners=True,
+        )
+        warped0, warped1 = torch.split(
+            warped.reshape(n, 6, height, width), [3, 3], dim=1
+        )
+        return warped0 * mask + warped1 * (1 - mask)
+
+    def getUpscaledGrid(self, height: int, width: int) -> tuple:
+        """
+        Returns the backwarp grid and the flow divisor for frames of this size, like backwarp_tenGrid and tenFlow_div of rife 4.7 and later
+        """
+        grid = self.upscaledGrids.get((height, width))
+        if grid is None:
+            hMul = 2 / (width - 1)
+            vMul = 2 / (height - 1)
+            flowDiv = torch.tensor(
+                [hMul, vMul], device=self.device, dtype=self.dtype
+            ).reshape(1, 2, 1, 1)
+            backwarpGrid = torch.cat(
+                (
+                    (torch.arange(width) * hMul - 1)
+                    .reshape(1, 1, 1, -1)
+                    .expand(-1, -1, height, -1),
+                    (torch.arange(height) * vMul - 1)
+                    .reshape(1, 1, -1, 1)
+                    .expand(-1, -1, -1, width),
+                ),
+                dim=1,
+            ).to(device=self.device, dtype=self.dtype)
+            grid = self.upscaledGrids[(height, width)] = (backwarpGrid, flowDiv)
+        return grid
+
+    @torch.inference_mode()
+    def blendUpscaled(self, upscaled0, upscaled1, timestep: float) -> torch.Tensor:
+        """
+        Blends the upscaled frames of a static pair linearly, the output matches processUpscaledBatch
+        """
+        with torch.cuda.stream(self.stream):
+            output = torch.lerp(
+                upscaled0.to(dtype=self.dtype), upscaled1.to(dtype=self.dtype), timestep
+            )
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def tensor_to_padded_tensor(self, frame: torch.Tensor) -> torch.Tensor:
+        """
+        Takes in a (1, 3, H, W) tensor that is already on the device, and copies it into a staging tensor like frame_to_tensor
+        """
+        with torch.cuda.stream(self.prepareStream):
+            staging = self.nextStagingFrame()
+            staging[:, :, : self.height, : self.width].copy_(frame)
+        self.prepareStream.synchronize()
+        return staging
+
+    def nextStagingFrame(self) -> torch.Tensor:
+        """
+        Returns the next padded tensor of the staging pool, it is overwritten once every staging tensor after it has been used.
+        Safe to call from several threads, each call gets a different tensor.
+        """
+        with self.stagingLock:
+            staging = self.stagingFrames[self.stagingIndex]
+            self.stagingIndex = (self.stagingIndex + 1) % len(self.stagingFrames)
+            # the tensor is about to hold a different frame
+            self.encodedFrames.pop(id(staging), None)
+            self.stagingFrameIndices[id(staging)] = (staging, self.stagedFrames)
+            self.stagedFrames += 1
+        return staging
+
+    @torch.inference_mode()
+    def padded_tensor_to_frame(self, frame: torch.Tensor):
+        """
+        Undoes frame_to_tensor, used to write out a source frame that was only set up on the device
+        """
+        return self.tensor_to_frame(
+            frame[:, :, : self.height, : self.width][0].permute(1, 2, 0).mul(255)
+        )
+
     @torch.inference_mode()
     def tensor_to_frame(self, frame: torch.Tensor):
         """
@@ -317,24 +774,23 @@ class InterpolateRifeTorch:
 
     @torch.inference_mode()
     def frame_to_tensor(self, frame) -> torch.Tensor:
+        """
+        Fills the next staging tensor with the frame, the uint8 to float conversion and the scale to 0-1 are one operation
+        """
         with torch.cuda.stream(self.prepareStream):
-            frame = (
-                torch.frombuffer(
-                    frame,
-                    dtype=torch.uint8,
-                )
-                .to(device=self.device, dtype=self.dtype, non_blocking=True)
-                .reshape(self.height, self.width, 3)
-                .permute(2, 0, 1)
-                .unsqueeze(0)
-                / 255.0
+            staging = self.nextStagingFrame()
+            frame = torch.frombuffer(frame, dtype=torch.uint8).view(
+                self.height, self.width, 3
             )
-            frame = F.pad(
-                (frame),
-                self.padding,
+            if self.uploadFrame is not None:
+                frame = self.uploadFrame.copy_(frame, non_blocking=True)
+            torch.mul(
+                frame.permute(2, 0, 1),
+                1 / 255,
+                out=staging[0, :, : self.height, : self.width],
             )
         self.prepareStream.synchronize()
-        return frame
+        return staging
 
     def enqueueV3(self, context, bindings, stream, input_shapes):
         # Use the non-default stream for TensorRT inference
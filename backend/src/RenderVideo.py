@@ -1,13 +1,34 @@
-from threading import Thread
+from threading import Thread, Lock, Semaphore
 from queue import Queue, Empty
+from collections import deque
 from multiprocessing import shared_memory
 import os
-import math
+import time
 
-from .FFmpeg import FFMpegRender
-from .SceneDetect import SceneDetect
+from .FFmpeg import FFMpegRender, probeVideoTiming
+from .Checkpoint import RenderCheckpoint, RenderAlreadyComplete
+from .SceneDetect import SceneDetect, InlineSceneDetect
+from .StagePlanner import (
+    planStageOrder,
+    getFlowScale,
+    INTERPOLATE_FIRST,
+    FLOW_REUSE,
+)
+from .DeferredFrame import DeferredFrame
+from .DuplicateFrameDetect import DuplicateFrameDetector, PREVIOUS_FRAME
+from .SceneModelTiers import SceneModelTiers, LITE_TIER
+from .StaticPairDetect import (
+    StaticPairDetector,
+    blendFrames,
+    IDENTICAL_PAIR,
+)
 from .Util import printAndLog, log
 
+# frames handed between the prefetch, render and download stages, kept small as these hold frames in device memory
+STAGE_QUEUE_SIZE = 2
+# handed to the download stage after the last output of a frame or pair, so it can move on to the next one
+END_OF_SEQUENCE = "end_of_sequence"
+
 # try/except imports
 try:
     from .UpscaleNCNN import UpscaleNCNN, getNCNNScale
@@ -38,11 +59,44 @@ class Render(FFMpegRender):
     backend (pytorch,ncnn,tensorrt)
     device (cpu,cuda)
     precision (float16,float32)
+    batchSize (number of frames upscaled per model call, pytorch backend only)
+    dedup (reuse the output of duplicate frames when upscaling)
+    dedupThreshold (mean absolute difference of downsampled frames, under which a frame is a duplicate)
+    dedupCacheSize (number of recent outputs kept for frames that repeat later)
+    skipStatic (blend or repeat the frames of pairs with next to no motion, instead of interpolating them)
+    staticThreshold (mean absolute difference of downsampled frames, under which a pair is static)
+    flowScale (resolution rife estimates the flow at, 1, 0.5, 0.25, or auto to pick it from the resolution, ncnn only supports 1 and 0.5)
+    liteInterpolateModel (a cheaper rife model for scenes that barely move, the interpolateModel renders the rest, pytorch backend only)
+    tierThreshold (mean flow in pixels, above which a scene is interpolated with the interpolateModel instead of the liteInterpolateModel)
+    warmStart (start the flow of each pair from the flow of the pair before it, skipping the coarsest rife block, pytorch backend with a single inference worker only)
+    flowReuse (when upscaling and interpolating, estimate the flow at the input resolution and warp the upscaled frames with it, pytorch backend only)
+    sceneDetectWorkers (number of processes pyscenedetect runs in, each one detects a part of the video)
+    queueMemoryMB (memory budget of the frames waiting to be rendered and written, in each process when rendering segments)
+    inferenceWorkers (number of render threads sharing the model, each gets an even share of the cpu threads torch uses, pytorch backend only)
+    processPipeline (decode and encode in their own processes, frames are passed to and from them through shared memory)
+
+    SegmentOptions (set by SegmentRender when the video is split across processes):
+    startFrame, the first frame of the segment
+    frameCount, the length of the segment, this replaces the frame count of the whole video
+    sceneTransitions, transitions already detected on the whole video, relative to startFrame
+    copyAudio, disabled for segments, as the audio is muxed in once when the segments are joined
+    sharedUpscaleWeights, sharedInterpolateWeights, weights written once by SegmentRender, mapped by every segment instead of loading the models, pytorch backend only
+
+    ResumeOptions:
+    resume, write the output in chunks with a checkpoint, and skip the chunks a previous render already finished
+    resumeChunkSize, the number of input frames in each chunk
+
+    Stages, each runs in its own thread, with a small queue between them:
+    prefetch, reads frames, checks for duplicates and sets them up for the model (bytes to tensor), and numbers every frame (pair when interpolating)
+    render, only runs the models, in inferenceWorkers threads
+    download, puts the outputs back in order, quantizes them and copies them to the host, then hands them to the writer
+    The time each stage spends working is printed at the end, the busiest stage is the one limiting the render.
 
     NOTE:
     Everything in here has to happen in a specific order:
     Get the video properties (res,fps,etc)
     set up upscaling/interpolation, this gets the scale for upscaling if upscaling is the current task
+    when upscaling and interpolating, both models run in one pass, the order is picked by StagePlanner
     assign framechunksize to a value, as this is needed to catch bytes and set up shared memory
     set up shared memory
     """
@@ -58,7 +112,18 @@ class Render(FFMpegRender):
         # model settings
         upscaleModel=None,
         interpolateModel=None,
-        interpolateFactor: int = 1,
+        interpolateFactor: float = 1,
+        batchSize: int = 1,
+        dedup: bool = False,
+        dedupThreshold: float = 0.5,
+        dedupCacheSize: int = 4,
+        skipStatic: bool = False,
+        staticThreshold: float = 1.0,
+        flowScale: float | str = 1.0,
+        liteInterpolateModel: str = None,
+        tierThreshold: float = 3.0,
+        warmStart: bool = False,
+        flowReuse: bool = False,
         # ffmpeg settings
         encoder: str = "libx264",
         pixelFormat: str = "yuv420p",
@@ -68,8 +133,22 @@ class Render(FFMpegRender):
         # misc
         sceneDetectMethod: str = "pyscenedetect",
         sceneDetectSensitivity: float = 3.0,
+        sceneDetectWorkers: int = 1,
         sharedMemoryID: str = None,
         trt_optimization_level: int = 3,
+        queueMemoryMB: int = 2048,
+        processPipeline: bool = False,
+        inferenceWorkers: int = 1,
+        # segment settings
+        startFrame: int = 0,
+        frameCount: int = None,
+        sceneTransitions: list[int] = None,
+        copyAudio: bool = True,
+        sharedUpscaleWeights: str = None,
+        sharedInterpolateWeights: str = None,
+        # resume settings
+        resume: bool = False,
+        resumeChunkSize: int = 1000,
     ):
         self.inputFile = inputFile
         self.backend = backend
@@ -79,26 +158,164 @@ class Render(FFMpegRender):
         self.precision = precision
         self.upscaleTimes = 1  # if no upscaling, it will default to 1
         self.interpolateFactor = interpolateFactor
-        self.ceilInterpolateFactor = math.ceil(self.interpolateFactor)
+        self.batchSize = max(1, batchSize)
+        self.inferenceWorkers = max(1, inferenceWorkers)
+        if self.inferenceWorkers > 1 and backend != "pytorch":
+            # tensorrt execution contexts and ncnn nets can not be run from several threads at once
+            printAndLog(
+                f"{self.inferenceWorkers} inference workers are not supported on {backend}, using 1"
+            )
+            self.inferenceWorkers = 1
         self.setupRender = self.returnFrame  # set it to not convert the bytes to array by default, and just pass chunk through
-        self.frame0 = None
+        # converts an output of the models to a frame ffmpeg can write, in the download stage. None when the output already is one
+        self.download = None
+        self.passthroughDownload = None
+        # interpolates every timestep of a pair at once, None when the backend runs one timestep at a time
+        self.interpolateBatch = None
+        # takes the place of self.interpolate for static pairs, mapped to a blend on the device by the pytorch backends
+        self.blend = blendFrames
         self.sceneDetectMethod = sceneDetectMethod
         self.sceneDetectSensitivty = sceneDetectSensitivity
+        self.sceneDetectWorkers = sceneDetectWorkers
         self.sharedMemoryID = sharedMemoryID
         self.trt_optimization_level = trt_optimization_level
+        self.sceneTransitions = sceneTransitions
+        self.sceneDetector = None
+        self.startFrame = startFrame
+        self.sharedUpscaleWeights = sharedUpscaleWeights
+        self.sharedInterpolateWeights = sharedInterpolateWeights
+        self.flowScale = flowScale
+        self.liteInterpolateModel = liteInterpolateModel
+        self.tierThreshold = tierThreshold
+        self.warmStart = warmStart
+        if self.warmStart and self.inferenceWorkers > 1:
+            # pairs finish in any order across threads, so whether a pair is warm started would depend on timing
+            printAndLog(
+                "Warm starting the flow needs a single inference worker, every pair starts from the first block"
+            )
+            self.warmStart = False
+        self.flowReuse = flowReuse
+        # set up by setupInterpolate, with the pytorch and tensorrt backends
+        self.interpolateRifePytorch = None
+        # set up by setupModelTiers, when scenes are split between two interpolation models
+        self.modelTiers = None
+        self.liteInterpolate = None
+        self.liteInterpolateBatch = None
         # get video properties early
         self.getVideoProperties(inputFile)
+        if frameCount is not None:
+            self.totalInputFrames = frameCount
+
+        self.checkpoint = None
+        if resume and not benchmark:
+            # chunks start at a frame number, which is only found by time when the frame rate is constant
+            if probeVideoTiming(inputFile)[1]:
+                raise os.error("Resuming needs a video with a constant frame rate!")
+            self.checkpoint = RenderCheckpoint(
+                outputFile,
+                settings={
+                    "inputFile": os.path.abspath(inputFile),
+                    "inputSize": os.path.getsize(inputFile),
+                    "inputModified": os.path.getmtime(inputFile),
+                    "width": self.width,
+                    "height": self.height,
+                    "fps": self.fps,
+                    "totalInputFrames": self.totalInputFrames,
+                    "interpolateFactor": self.interpolateFactor,
+                    "backend": backend,
+                    "precision": precision,
+                    "encoder": encoder,
+                    "pixelFormat": pixelFormat,
+                    "crf": crf,
+                    "sceneDetectMethod": sceneDetectMethod,
+                    "sceneDetectSensitivity": sceneDetectSensitivity,
+                    # auto is resolved again at the upscaled resolution when upscaling runs first, so the setting is kept as well
+                    "flowScale": flowScale if flowScale == "auto" else float(flowScale),
+                    "resolvedFlowScale": getFlowScale(
+                        self.width, self.height, flowScale
+                    ),
+                    "tierThreshold": tierThreshold,
+                    "dedup": dedup,
+                    "dedupThreshold": dedupThreshold,
+                    "dedupCacheSize": dedupCacheSize,
+                    "skipStatic": skipStatic,
+                    "staticThreshold": staticThreshold,
+                    "warmStart": self.warmStart,
+                    # the stage order is planned once the upscale model is loaded, from the settings and models above
+                    "flowReuse": flowReuse,
+                },
+                modelPaths=[
+                    model
+                    for model in (
+                        upscaleModel,
+                        interpolateModel,
+                        liteInterpolateModel,
+                    )
+                    if model
+                ],
+                chunkSize=resumeChunkSize,
+                extension=os.path.splitext(outputFile)[1],
+            )
+            # chunks are ranges of the frames that are read in, or of the pairs when interpolating
+            renderedFrames = self.totalInputFrames - (2 if interpolateModel else 1)
+            if self.checkpoint.isComplete(renderedFrames):
+                printAndLog("Every chunk is already rendered")
+                self.checkpoint.stitch(
+                    outputFile, audioFile=inputFile, overwrite=overwrite
+                )
+                # nothing is set up past this point, so the render can not be used
+                raise RenderAlreadyComplete(outputFile)
+            self.startFrame = self.checkpoint.firstMissingChunk() * resumeChunkSize
+            self.totalInputFrames -= self.startFrame
+            copyAudio = False
+
+        self.duplicateDetector = None
+        if dedup and upscaleModel and not interpolateModel:
+            self.duplicateDetector = DuplicateFrameDetector(
+                width=self.width,
+                height=self.height,
+                threshold=dedupThreshold,
+                cacheSize=dedupCacheSize,
+            )
+        self.staticPairDetector = None
+        if skipStatic and interpolateModel:
+            self.staticPairDetector = StaticPairDetector(
+                width=self.width,
+                height=self.height,
+                threshold=staticThreshold,
+            )
 
         printAndLog("Using backend: " + self.backend)
-        if upscaleModel:
+        if upscaleModel and interpolateModel:
+            self.setupUpscaleInterpolate()
+            self.prefetchThread = Thread(target=self.prefetchInterpolate)
+            renderTarget = self.renderInterpolate
+            printAndLog("Using Upscaling Model: " + self.upscaleModel)
+            printAndLog("Using Interpolation Model: " + self.interpolateModel)
+        elif upscaleModel:
             self.setupUpscale()
-            self.renderThread = Thread(target=self.renderUpscale)
+            self.prefetchThread = Thread(target=self.prefetchUpscale)
+            renderTarget = self.renderUpscale
             printAndLog("Using Upscaling Model: " + self.upscaleModel)
-        if interpolateModel:
+        elif interpolateModel:
             self.setupInterpolate()
-            self.renderThread = Thread(target=self.renderInterpolate)
+            self.prefetchThread = Thread(target=self.prefetchInterpolate)
+            renderTarget = self.renderInterpolate
             printAndLog("Using Interpolation Model: " + self.interpolateModel)
+        if self.inferenceWorkers > 1:
+            self.setupInferenceWorkers()
+        self.renderThreads = [
+            Thread(target=renderTarget) for _ in range(self.inferenceWorkers)
+        ]
+        self.downloadThread = Thread(target=self.downloadFrames)
+        self.setupQueue = Queue(maxsize=STAGE_QUEUE_SIZE)
+        self.downloadQueue = Queue(maxsize=STAGE_QUEUE_SIZE)
+        # the prefetch stage waits on this before each frame, so it never gets further ahead of the writer than the staging tensors allow
+        self.renderWindow = Semaphore(self.getRenderWindow())
+        self.stageBusyTime = {"prefetch": 0.0, "render": 0.0, "download": 0.0}
+        self.stageBusyTimeLock = Lock()
 
+        # the output is always at the upscaled resolution, whichever order the models run in
         self.inputFrameChunkSize = self.width * self.height * 3
         self.outputFrameChunkSize = (
             self.width * self.upscaleTimes * self.height * self.upscaleTimes * 3
@@ -121,6 +338,14 @@ class Render(FFMpegRender):
             shm=self.shm,
             inputFrameChunkSize=self.inputFrameChunkSize,
             outputFrameChunkSize=self.outputFrameChunkSize,
+            startFrame=self.startFrame,
+            copyAudio=copyAudio,
+            checkpoint=self.checkpoint,
+            sceneDetector=self.sceneDetector,
+            queueMemoryMB=queueMemoryMB,
+            # source frames can be anywhere in the render window, and one is held by each stage, and by the static pair detector
+            extraReadBuffers=self.getRenderWindow() + 4,
+            processPipeline=processPipeline,
         )
 
         self.sharedMemoryThread = Thread(
@@ -130,84 +355,400 @@ class Render(FFMpegRender):
         self.ffmpegReadThread = Thread(target=self.readinVideoFrames)
         self.ffmpegWriteThread = Thread(target=self.writeOutVideoFrames)
 
+        self.stageStartTime = time.time()
         self.ffmpegReadThread.start()
         self.ffmpegWriteThread.start()
-        self.renderThread.start()
+        self.prefetchThread.start()
+        for renderThread in self.renderThreads:
+            renderThread.start()
+        self.downloadThread.start()
+
+    def waitForRender(self):
+        """
+        Blocks until every thread of the render has finished
+        """
+        for thread in (
+            self.ffmpegReadThread,
+            self.prefetchThread,
+            *self.renderThreads,
+            self.downloadThread,
+            self.ffmpegWriteThread,
+            self.sharedMemoryThread,
+        ):
+            thread.join()
+
+    def getRenderWindow(self) -> int:
+        """
+        Returns the number of frames (pairs when interpolating) that can be between the prefetch stage and the writer at once.
+        The render threads can finish out of order, so this covers every thread holding a batch, and the frames waiting around them.
+        """
+        if self.interpolateModel:
+            return self.inferenceWorkers + STAGE_QUEUE_SIZE
+        return self.batchSize * (self.inferenceWorkers + 1) + STAGE_QUEUE_SIZE
+
+    def setupInferenceWorkers(self):
+        """
+        Splits the cpu threads torch uses between the render threads, so they do not fight over the same cores.
+        The thread count is global in torch, every render thread gets an even share of it.
+        """
+        import torch
+
+        threadsPerWorker = max(1, (os.cpu_count() or 1) // self.inferenceWorkers)
+        torch.set_num_threads(threadsPerWorker)
+        printAndLog(
+            f"Rendering in {self.inferenceWorkers} threads, with {threadsPerWorker} cpu threads each"
+        )
+
+    def passthroughFrame(self, frame, setupFrame):
+        """
+        Returns what is written out for a source frame, when interpolating it is passed through as is.
+        When another model runs after interpolation, this is mapped to a function that runs it on the frame.
+        """
+        return frame
+
+    def prefetchUpscale(self):
+        """
+        The prefetch stage when upscaling, checks every frame for duplicates and sets up the ones that have to be rendered.
+        Frames are grouped into batches of up to batchSize frames to render, duplicates are kept in order with them.
+        Puts lists of (sequence, key, setupFrame, match) in the setupQueue, setupFrame is None when the frame reuses an output.
+        """
+        batch = []
+        framesToRender = 0
+        sequence = 0
+        while True:
+            self.renderWindow.acquire()
+            frame = self.readFrame()
+            if frame is None:
+                break
+            start = time.perf_counter()
+            key = None
+            match = None
+            if self.duplicateDetector is not None:
+                key, match = self.duplicateDetector.check(frame)
+            setupFrame = self.frameSetupFunction(frame) if match is None else None
+            # the set up frame is a copy, so the read buffer can go back to the reader
+            self.releaseFrame(frame)
+            self.stageBusyTime["prefetch"] += time.perf_counter() - start
+            batch.append((sequence, key, setupFrame, match))
+            sequence += 1
+            if match is None:
+                framesToRender += 1
+            # a duplicate with nothing to wait on goes out right away
+            # batches are capped by every frame they hold, not only the ones to render, as each one holds a place in the render window
+            if framesToRender == 0 or len(batch) == self.batchSize:
+                self.setupQueue.put(batch)
+                batch = []
+                framesToRender = 0
+        # partial batch left over at the end of the video
+        if batch:
+            self.setupQueue.put(batch)
+        self.setupQueue.put(None)
+        if self.duplicateDetector is not None:
+            self.duplicateDetector.report()
 
     def renderUpscale(self):
         """
-        self.setupRender, method that is mapped to the bytesToFrame in each respective backend
-        self.upscale, method that takes in a chunk, and outputs an array that can be sent to ffmpeg
+        self.setupRender, method that is mapped to the bytesToFrame in each respective backend, this runs in the prefetch stage
+        self.upscale, method that takes in a set up frame, and outputs what the download stage turns into an array that can be sent to ffmpeg
+        self.upscaleBatch, same as self.upscale, but takes in a list of frames and runs them through the model at once
+        self.duplicateDetector, if set, frames that match the last rendered frame or a recently cached frame reuse its output
+
+        Runs in every render thread, each takes the next batch from the setupQueue, so batches can finish out of order.
         """
         log("Starting Upscale")
-        for i in range(self.totalInputFrames - 1):
-            frame = self.readQueue.get()
-            frame = self.upscale(self.frameSetupFunction(frame))
-            self.writeQueue.put(frame)
-        self.writeQueue.put(None)
+        while True:
+            batch = self.setupQueue.get()
+            if batch is None:
+                # left in the queue for the other render threads
+                self.setupQueue.put(None)
+                break
+            self.flushUpscale(batch)
+        self.downloadQueue.put(None)
         log("Finished Upscale")
 
+    def flushUpscale(self, batch: list):
+        """
+        Renders the frames in batch in one model call, and hands every frame of the batch to the download stage.
+        batch is a list of (sequence, key, setupFrame, match), setupFrame is None when the frame reuses an output.
+        A frame that matches the frame before it is resolved by the download stage, as that frame can still be rendering in another thread.
+        """
+        start = time.perf_counter()
+        frames = [setupFrame for _, _, setupFrame, _ in batch if setupFrame is not None]
+        if len(frames) == 1:
+            outputs = iter([self.upscale(frames[0])])
+        else:
+            outputs = iter(self.upscaleBatch(frames) if frames else [])
+        self.addBusyTime("render", start)
+
+        for sequence, key, setupFrame, match in batch:
+            if setupFrame is not None:
+                output = next(outputs)
+                if self.duplicateDetector is not None:
+                    # the outputs of a batch are views of one tensor, a cached view would keep the whole batch alive
+                    self.duplicateDetector.store(
+                        key, output.clone() if len(frames) > 1 else output
+                    )
+            else:
+                output = match
+            self.queueDownload(sequence, output, self.download)
+            self.queueDownload(sequence, END_OF_SEQUENCE, None)
+
+    def prefetchInterpolate(self):
+        """
+        The prefetch stage when interpolating, pairs every frame with the frame before it.
+        Puts (sequence, frame1, setupFrame0, setupFrame1, transition, staticPair, scene) in the setupQueue, the sequence is the index of the pair.
+        scene counts the transitions before the pair, so every pair of a scene has the same one.
+        frame1 is kept, as source frames are written out as is, the render stage releases it.
+        Pairs are checked for scene changes and for motion here, as they have to be checked in order.
+        """
+        try:
+            self.transitionFrame = self.transitionQueue.get_nowait()
+        except (AttributeError, Empty):
+            self.transitionFrame = -1  # if there is no transition queue, or no transitions, set it to -1
+        frame0 = self.readFrame()
+        if frame0 is None:
+            self.setupQueue.put(None)
+            return
+        start = time.perf_counter()
+        if self.staticPairDetector is not None:
+            self.checkStaticPair(frame0)
+        setupFrame0 = self.frameSetupFunction(frame0)
+        self.releaseFrame(frame0)
+        self.stageBusyTime["prefetch"] += time.perf_counter() - start
+
+        scene = 0
+        for frameNum in range(self.totalInputFrames - 1):
+            self.renderWindow.acquire()
+            frame1 = self.readFrame()
+            if frame1 is None:
+                break
+            start = time.perf_counter()
+            staticPair = None
+            if self.staticPairDetector is not None:
+                staticPair = self.checkStaticPair(frame1)
+            setupFrame1 = self.frameSetupFunction(frame1)
+            self.stageBusyTime["prefetch"] += time.perf_counter() - start
+            # checked outside of the busy time, inline scene detection can wait on the reader here
+            transition = self.isTransition(frameNum)
+            self.setupQueue.put(
+                (
+                    frameNum,
+                    frame1,
+                    setupFrame0,
+                    setupFrame1,
+                    transition,
+                    staticPair,
+                    scene,
+                )
+            )
+            if transition:
+                scene += 1
+            setupFrame0 = setupFrame1
+        self.setupQueue.put(None)
+        if self.staticPairDetector is not None:
+            self.releaseFrame(self.staticPairDetector.previousFrame)
+            self.staticPairDetector.report()
+
+    def checkStaticPair(self, frame):
+        """
+        Checks the pair of the last read frame and this one with the staticPairDetector.
+        The detector compares the next frame to this one, so it is kept in its read buffer until then.
+        """
+        previousFrame = self.staticPairDetector.previousFrame
+        staticPair = self.staticPairDetector.check(frame)
+        self.retainFrame(frame)
+        if previousFrame is not None:
+            self.releaseFrame(previousFrame)
+        return staticPair
+
+    def queueDownload(self, sequence: int, output, download):
+        """
+        Hands an output of the frame or pair numbered sequence to the download stage, download converts it to a frame ffmpeg can write, None if it already is one.
+        END_OF_SEQUENCE is queued after the last output of each sequence.
+        A source frame that is written out as is stays in its read buffer until the download stage has passed it on.
+        """
+        self.retainFrame(output)
+        self.downloadQueue.put((sequence, output, download))
+
+    def addBusyTime(self, stage: str, start: float):
+        # the render stage is timed from several threads
+        with self.stageBusyTimeLock:
+            self.stageBusyTime[stage] += time.perf_counter() - start
+
+    def downloadFrames(self):
+        """
+        The download stage, converts the outputs of the render threads to frames and hands them to the writer.
+        The render threads can finish out of order, so outputs wait in a reorder buffer until every sequence before theirs is written.
+        """
+        waiting = {}
+        nextSequence = 0
+        lastFrame = None
+        finishedThreads = 0
+        while finishedThreads < self.inferenceWorkers:
+            item = self.downloadQueue.get()
+            if item is None:
+                finishedThreads += 1
+                continue
+            sequence, output, download = item
+            waiting.setdefault(sequence, deque()).append((output, download))
+            while waiting.get(nextSequence):
+                output, download = waiting[nextSequence].popleft()
+                if output is END_OF_SEQUENCE:
+                    del waiting[nextSequence]
+                    nextSequence += 1
+                    self.renderWindow.release()
+                    continue
+                start = time.perf_counter()
+                if output is PREVIOUS_FRAME:
+                    frame = lastFrame
+                else:
+                    frame = output if download is None else download(output)
+                self.stageBusyTime["download"] += time.perf_counter() - start
+                self.writeFrame(frame)
+                self.releaseFrame(output)
+                lastFrame = frame
+        self.writeQueue.put(None)
+        self.reportStageBusyTime()
+        if self.modelTiers is not None:
+            self.modelTiers.report()
+        if self.interpolateRifePytorch is not None:
+            self.interpolateRifePytorch.reportWarmStarts()
+
+    def reportStageBusyTime(self):
+        totalTime = max(time.time() - self.stageStartTime, 1e-6)
+        for stage, busyTime in self.stageBusyTime.items():
+            if stage == "render":
+                # summed over the render threads
+                busyTime /= self.inferenceWorkers
+            printAndLog(
+                f"{stage} stage busy for {round(busyTime, 2)}s ({round(100 * busyTime / totalTime, 1)}%)"
+            )
+
     def renderInterpolate(self):
         """Method that performs interpolation between frames.\n
         This method takes in a chunk of frames and outputs an array that can be sent to ffmpeg.\n
-        It starts by setting up the initial frame (frame0) using the frameSetupFunction.\n
-        Then, for each frame in the input frames, it retrieves the next frame (frame1) from the readQueue.\n
-        If frame1 is None, the loop breaks.\n
-        If the current frame number is not the transitionFrame, it performs interpolation by calling the interpolate method.\n
-        The interpolation is done by generating intermediate frames between frame0 and frame1 using the interpolateFactor.\n
-        The resulting frames are then added to the writeQueue.\n
-        If the current frame number is the transitionFrame, it uncaches the cached frame and adds it to the writeQueue.\n
-        After each iteration, frame0 is updated to setup_frame1.\n
-        Finally, None is added to the writeQueue to signal the end of interpolation.\n
+        It runs in every render thread, each takes the next pair from the setupQueue, pairs are independent once both frames are set up.\n
+        For each pair, it gets frame1, the set up copies of frame0 and frame1, whether the pair crosses a scene change, and whether it is static, frames are views into the reusable read buffers.\n
+        If the item is None, the loop breaks, and None is put back for the other render threads.\n
+        If the pair is not a transition, it performs interpolation by calling the interpolate method, or interpolateBatch once for every timestep of the pair when there are several.\n
+        When scenes are split between two models, modelTiers picks the model for the scene of the pair.\n
+        The interpolation is done by generating intermediate frames between frame0 and frame1, at the timesteps the timestepScheduler maps to the pair.\n
+        The resulting frames are then handed to the download stage with queueDownload, numbered with the index of the pair, so they can be put back in order.\n
+        If the pair is a transition, it uncaches the cached frame and hands it to the download stage.\n
+        If the pair is static, frame1 is repeated when it is identical to frame0, otherwise the frames are blended with the blend method, the model is skipped.\n
+        After each pair, END_OF_SEQUENCE is queued, even for a pair with no outputs, and the read buffer of frame1 is released.\n
+        Finally, None is added to the downloadQueue to signal this thread is done.\n
         *NOTE:
-        - The frameSetupFunction is used to convert the frames to the desired format.
-        - The transitionFrame is obtained from the transitionQueue.
+        - The frameSetupFunction is used to convert the frames to the desired format, in the prefetch stage.
+        - Transitions are checked in the prefetch stage, see isTransition.
         - The interpolate method performs the actual interpolation between frames.
         Returns:
         None
         """
 
         log("Starting Interpolation")
-        try:
-            self.transitionFrame = self.transitionQueue.get()
-        except AttributeError:
-            self.transitionFrame = -1  # if there is no transition queue, set it to -1
-        self.frame0 = self.frameSetupFunction(self.readQueue.get())
-
-        for frameNum in range(self.totalInputFrames - 1):
-            frame1 = self.readQueue.get()
-            if frame1 is None:
+        while True:
+            item = self.setupQueue.get()
+            if item is None:
+                # left in the queue for the other render threads
+                self.setupQueue.put(None)
                 break
-            setup_frame1 = self.frameSetupFunction(frame1)
-            if frameNum != self.transitionFrame:
-                for n in range(self.ceilInterpolateFactor):
-                    timestep = 1 / (self.ceilInterpolateFactor - n)
+            (
+                frameNum,
+                frame1,
+                setup_frame0,
+                setup_frame1,
+                transition,
+                staticPair,
+                scene,
+            ) = item
+            # the pair index in the whole video, as segments and resumed renders start part way through
+            timesteps = self.timestepScheduler.getTimesteps(self.startFrame + frameNum)
+            start = time.perf_counter()
+            if not transition and staticPair is not None:
+                # the model is skipped, so it has to forget the frames of the last pair it rendered, like at a scene change
+                self.undoSetup(frame1)
+                passthrough = None
+                for timestep in timesteps:
+                    if timestep == 1 or staticPair == IDENTICAL_PAIR:
+                        if passthrough is None:
+                            passthrough = self.passthroughFrame(frame1, setup_frame1)
+                        self.queueDownload(
+                            frameNum, passthrough, self.passthroughDownload
+                        )
+                        continue
+
+                    frame = self.blend(setup_frame0, setup_frame1, timestep)
+                    self.queueDownload(frameNum, frame, self.download)
+            elif not transition:
+                interpolate = self.interpolate
+                interpolateBatch = self.interpolateBatch
+                if (
+                    self.modelTiers is not None
+                    and self.modelTiers.getTier(scene, setup_frame0, setup_frame1)
+                    == LITE_TIER
+                ):
+                    interpolate = self.liteInterpolate
+                    interpolateBatch = self.liteInterpolateBatch
+                interpolateTimesteps = [
+                    timestep for timestep in timesteps if timestep != 1
+                ]
+                outputs = None
+                if interpolateBatch is not None and len(interpolateTimesteps) > 1:
+                    outputs = iter(
+                        interpolateBatch(
+                            setup_frame0, setup_frame1, interpolateTimesteps
+                        )
+                    )
+                for timestep in timesteps:
                     if timestep == 1:
-                        self.writeQueue.put(frame1)
+                        self.queueDownload(
+                            frameNum,
+                            self.passthroughFrame(frame1, setup_frame1),
+                            self.passthroughDownload,
+                        )
                         continue
 
-                    frame = self.interpolate(self.frame0, setup_frame1, timestep)
-                    self.writeQueue.put(frame)
+                    if outputs is not None:
+                        frame = next(outputs)
+                    else:
+                        frame = interpolate(setup_frame0, setup_frame1, timestep)
+                    self.queueDownload(frameNum, frame, self.download)
             else:
                 # uncache the cached frame
                 self.undoSetup(frame1)
-                for n in range(self.ceilInterpolateFactor):
-                    self.writeQueue.put(frame1)
-                try:  # get_nowait sends an error out of the queue is empty, I would like a better solution than this though
-                    self.transitionFrame = self.transitionQueue.get_nowait()
-                except Empty:
-                    self.transitionFrame = None
-            self.frame0 = setup_frame1
+                frame = self.passthroughFrame(frame1, setup_frame1)
+                for timestep in timesteps:
+                    self.queueDownload(frameNum, frame, self.passthroughDownload)
+            self.addBusyTime("render", start)
+            self.queueDownload(frameNum, END_OF_SEQUENCE, None)
+            # frames written out as is were retained by queueDownload, the set up frame is a copy
+            self.releaseFrame(frame1)
 
-        self.writeQueue.put(None)
+        self.downloadQueue.put(None)
         log("Finished Interpolation")
 
+    def isTransition(self, frameNum: int) -> bool:
+        """
+        Returns if the pair (frameNum, frameNum + 1) crosses a scene change, pairs have to be checked in order.
+        """
+        if self.sceneDetector is not None:
+            return self.sceneDetector.isTransition(frameNum)
+        if frameNum != self.transitionFrame:
+            return False
+        try:  # get_nowait sends an error out of the queue is empty, I would like a better solution than this though
+            self.transitionFrame = self.transitionQueue.get_nowait()
+        except Empty:
+            self.transitionFrame = None
+        return True
+
     def setupUpscale(self):
         """
         This is called to setup an upscaling model if it exists.
         Maps the self.upscaleTimes to the actual scale of the model
         Maps the self.setupRender function that can setup frames to be rendered
         Maps the self.upscale the upscale function in the respective backend.
+        Maps the self.upscaleBatch to the batched upscale function, only the pytorch backend supports batches
         For interpolation:
         Mapss the self.undoSetup to the tensor_to_frame function, which undoes the prep done in the FFMpeg thread. Used for SCDetect
         """
@@ -220,10 +761,16 @@ class Render(FFMpegRender):
                 width=self.width,
                 height=self.height,
                 backend=self.backend,
+                # every frame in the render window can still be waiting on its set up frame
+                stagingBuffers=self.getRenderWindow() + 1,
+                sharedWeights=self.sharedUpscaleWeights,
             )
             self.upscaleTimes = upscalePytorch.getScale()
             self.setupRender = upscalePytorch.bytesToFrame
-            self.upscale = upscalePytorch.renderToNPArray
+            self.upscale = upscalePytorch.renderToTensor
+            self.upscaleImage = upscalePytorch.renderImage
+            self.upscaleBatch = upscalePytorch.renderBatchToTensors
+            self.download = upscalePytorch.tensorToNPArray
 
         if self.backend == "ncnn":
             path, last_folder = os.path.split(self.upscaleModel)
@@ -239,42 +786,260 @@ class Render(FFMpegRender):
                 width=self.width,
                 height=self.height,
             )
-            self.setupRender = self.returnFrame
+            # frames are views into the read buffers, ncnn takes a copy of them
+            self.setupRender = bytes
             self.upscale = upscaleNCNN.Upscale
 
-    def setupInterpolate(self):
+        if self.batchSize > 1 and self.backend != "pytorch":
+            # tensorrt engines are built with a static batch of 1, and ncnn takes a single frame
+            printAndLog(
+                f"Batch size {self.batchSize} is not supported on {self.backend}, using 1"
+            )
+            self.batchSize = 1
+        elif self.batchSize > 1:
+            printAndLog(f"Upscaling in batches of {self.batchSize} frames")
+
+    def setupInterpolate(
+        self, width: int = None, height: int = None, stagingBuffers: int = None
+    ):
+        """
+        width/height, the resolution the interpolation model runs at, defaults to the resolution of the video
+        stagingBuffers, the number of frames the pytorch backends set up at once, defaults to every frame of the render window
+        """
         log("Setting up Interpolation")
+        width = self.width if width is None else width
+        height = self.height if height is None else height
 
-        if self.sceneDetectMethod != "none":
+        if self.sceneTransitions is None and self.sceneDetectMethod == "inline":
+            # scored by the reader as the frames come in, the render starts right away
+            self.sceneDetector = InlineSceneDetect(
+                width=self.width,
+                height=self.height,
+                sceneChangeSensitivity=self.sceneDetectSensitivty,
+            )
+        elif self.sceneTransitions is None and self.sceneDetectMethod != "none":
             printAndLog("Detecting Transitions")
             scdetect = SceneDetect(
                 inputFile=self.inputFile,
                 sceneChangeSensitivity=self.sceneDetectSensitivty,
                 sceneChangeMethod=self.sceneDetectMethod,
+                workers=self.sceneDetectWorkers,
             )
-            self.transitionQueue = scdetect.getTransitions()
+            # transitions are detected on the whole video, make them relative to the frame this render starts on
+            self.sceneTransitions = [
+                transition - self.startFrame
+                for transition in scdetect.getTransitionList()
+                if transition >= self.startFrame
+            ]
+        if self.sceneTransitions is not None:
+            self.transitionQueue = Queue()
+            for transition in self.sceneTransitions:
+                self.transitionQueue.put(transition)
         else:
             self.transitionQueue = None
         if self.backend == "ncnn":
+            # ncnn only has a half resolution mode
             interpolateRifeNCNN = InterpolateRIFENCNN(
                 interpolateModelPath=self.interpolateModel,
-                width=self.width,
-                height=self.height,
+                width=width,
+                height=height,
+                uhdMode=getFlowScale(width, height, self.flowScale) < 1,
             )
-            self.setupRender = self.returnFrame
+            # frames are views into the read buffers, frame0 is kept for the next pair so it needs its own copy
+            self.setupRender = bytes
             self.undoSetup = interpolateRifeNCNN.uncacheFrame
             self.interpolate = interpolateRifeNCNN.process
         if self.backend == "pytorch" or self.backend == "tensorrt":
             interpolateRifePytorch = InterpolateRifeTorch(
                 interpolateModelPath=self.interpolateModel,
-                ceilInterpolateFactor=self.ceilInterpolateFactor,
-                width=self.width,
-                height=self.height,
+                width=width,
+                height=height,
                 device=self.device,
                 dtype=self.precision,
                 backend=self.backend,
                 trt_optimization_level=self.trt_optimization_level,
+                # every pair in the render window holds its frame0 and frame1
+                stagingBuffers=(
+                    self.getRenderWindow() + 1
+                    if stagingBuffers is None
+                    else stagingBuffers
+                ),
+                sharedWeights=self.sharedInterpolateWeights,
+                flowScale=self.flowScale,
+                warmStart=self.warmStart,
             )
             self.setupRender = interpolateRifePytorch.frame_to_tensor
-            self.undoSetup = self.returnFrame
-            self.interpolate = interpolateRifePytorch.process
+            self.undoSetup = interpolateRifePytorch.uncacheFrame
+            self.interpolate = interpolateRifePytorch.processOnDevice
+            self.interpolateBatch = interpolateRifePytorch.processBatchOnDevice
+            self.blend = interpolateRifePytorch.blendOnDevice
+            self.download = interpolateRifePytorch.tensor_to_frame
+            self.interpolateRifePytorch = interpolateRifePytorch
+        if self.liteInterpolateModel is not None:
+            self.setupModelTiers(width, height)
+
+    def setupModelTiers(self, width: int, height: int):
+        """
+        Loads the lite interpolation model next to the full one, and has SceneModelTiers route every scene to one of them.
+        Scenes are measured by the flow of the lite model, only the pytorch backend returns it.
+        The upscaling passes wrap a single model, so this is only done when interpolating on its own.
+        """
+        if self.backend != "pytorch" or self.upscaleModel:
+            printAndLog(
+                "A lite interpolation model needs the pytorch backend without upscaling, only the full model is used"
+            )
+            return
+        liteInterpolateRifePytorch = InterpolateRifeTorch(
+            interpolateModelPath=self.liteInterpolateModel,
+            width=width,
+            height=height,
+            device=self.device,
+            dtype=self.precision,
+            backend=self.backend,
+            # frames are set up in the staging pool of the full model
+            stagingBuffers=1,
+            flowScale=self.flowScale,
+        )
+        self.liteInterpolate = liteInterpolateRifePytorch.processOnDevice
+        self.liteInterpolateBatch = liteInterpolateRifePytorch.processBatchOnDevice
+        self.modelTiers = SceneModelTiers(
+            measureMotion=liteInterpolateRifePytorch.flowMagnitude,
+            threshold=self.tierThreshold,
+        )
+
+    def setupUpscaleInterpolate(self):
+        """
+        Sets up upscaling and interpolation to run back to back in a single pass, frames stay in device memory between the models.
+        StagePlanner picks the cheaper order:
+        interpolate first, the pairs are interpolated at the input resolution, and every output frame is upscaled.
+        upscale first, every input frame is upscaled once, and the pairs are interpolated at the upscaled resolution.
+        With flowReuse, every input frame is upscaled once, and the flow is estimated at the input resolution,
+        the upscaled frames are warped with it, so rife never runs at the upscaled resolution.
+        The input frames are upscaled in the render stage, by the first render thread with a pair that needs them, see deferModelSetup.
+        """
+        self.batchSize = 1  # frames are upscaled one at a time as they are interpolated
+        self.setupUpscale()
+        upscaleSetup = self.setupRender
+        upscaleDownload = self.download
+        if self.flowReuse and self.backend == "pytorch":
+            self.stageOrder = FLOW_REUSE
+        else:
+            if self.flowReuse:
+                printAndLog(
+                    "Reusing the flow for the upscaled frames needs the pytorch backend, picking the stage order"
+                )
+            self.stageOrder = planStageOrder(
+                self.width, self.height, self.upscaleTimes, self.interpolateFactor
+            )
+        printAndLog(f"Upscaling and interpolating in one pass, {self.stageOrder}")
+
+        if self.stageOrder == FLOW_REUSE:
+            self.setupInterpolate()
+            interpolateRifePytorch = self.interpolateRifePytorch
+            # frames are set up for rife, and upscaled, the upscaled frames are the ones warped and written out
+            self.setupRender = lambda frame: (
+                interpolateRifePytorch.frame_to_tensor(frame),
+                upscaleSetup(frame),
+            )
+            processUpscaled = interpolateRifePytorch.processUpscaledBatch
+            self.interpolate = lambda img0, img1, timestep: processUpscaled(
+                img0[0], img1[0], [timestep], img0[1], img1[1]
+            )[0]
+            self.interpolateBatch = lambda img0, img1, timesteps: processUpscaled(
+                img0[0], img1[0], timesteps, img0[1], img1[1]
+            )
+            blendUpscaled = interpolateRifePytorch.blendUpscaled
+            self.blend = lambda img0, img1, timestep: blendUpscaled(
+                img0[1], img1[1], timestep
+            )
+            self.passthroughFrame = lambda frame, setupFrame: setupFrame[1]
+            self.download = upscaleDownload
+            self.passthroughDownload = upscaleDownload
+            self.deferModelSetup(
+                lambda setupFrame: (
+                    setupFrame[0],
+                    self.upscaleImage(setupFrame[1]).clamp(0.0, 1.0),
+                )
+            )
+        elif self.stageOrder == INTERPOLATE_FIRST:
+            self.setupInterpolate()
+            if self.backend == "ncnn":
+                interpolate = self.interpolate
+                self.interpolate = lambda img0, img1, timestep: self.upscale(
+                    interpolate(img0, img1, timestep)
+                )
+                self.blend = lambda img0, img1, timestep: self.upscale(
+                    blendFrames(img0, img1, timestep)
+                )
+                self.passthroughFrame = lambda frame, setupFrame: self.upscale(frame)
+            else:
+                interpolateRifePytorch = self.interpolateRifePytorch
+                self.interpolate = lambda img0, img1, timestep: self.upscale(
+                    interpolateRifePytorch.processToTensor(img0, img1, timestep)
+                )
+                self.interpolateBatch = lambda img0, img1, timesteps: [
+                    self.upscale(frame)
+                    for frame in interpolateRifePytorch.processBatchToTensor(
+                        img0, img1, timesteps
+                    )
+                ]
+                self.blend = lambda img0, img1, timestep: self.upscale(
+                    interpolateRifePytorch.blendToTensor(img0, img1, timestep)
+                )
+                # the set up frame is padded for rife, crop it back for the upscaling model
+                self.passthroughFrame = lambda frame, setupFrame: self.upscale(
+                    setupFrame[:, :, : self.height, : self.width].contiguous()
+                )
+                # every output comes out of the upscaling model
+                self.download = upscaleDownload
+                self.passthroughDownload = upscaleDownload
+        else:
+            self.setupInterpolate(
+                width=self.width * self.upscaleTimes,
+                height=self.height * self.upscaleTimes,
+                # frames are set up in the order the render threads reach them, not the order they are read in,
+                # so a frame can be set up after any frame a render window before or after it
+                stagingBuffers=2 * self.getRenderWindow() + 1,
+            )
+            self.setupRender = upscaleSetup
+            if self.backend == "ncnn":
+                self.passthroughFrame = lambda frame, setupFrame: setupFrame
+                self.deferModelSetup(lambda frame: self.upscale(frame).tobytes())
+            else:
+                interpolateRifePytorch = self.interpolateRifePytorch
+                self.passthroughFrame = (
+                    lambda frame, setupFrame: interpolateRifePytorch.padded_tensor_to_frame(
+                        setupFrame
+                    )
+                )
+                self.deferModelSetup(
+                    lambda frame: interpolateRifePytorch.tensor_to_padded_tensor(
+                        self.upscaleImage(frame).clamp(0.0, 1.0)
+                    )
+                )
+
+    def deferModelSetup(self, modelSetup):
+        """
+        Moves modelSetup out of the prefetch stage, into the render stage, so only the render threads run the models.
+        self.setupRender is left to do the cheap part of the set up, its frames are wrapped in a DeferredFrame,
+        and the methods that take set up frames run modelSetup on them, once for each frame, through DeferredFrame.get.
+        """
+        setupRender = self.setupRender
+        self.setupRender = lambda frame: DeferredFrame(setupRender(frame), modelSetup)
+        interpolate = self.interpolate
+        self.interpolate = lambda img0, img1, timestep: interpolate(
+            img0.get(), img1.get(), timestep
+        )
+        interpolateBatch = self.interpolateBatch
+        if interpolateBatch is not None:
+            self.interpolateBatch = lambda img0, img1, timesteps: interpolateBatch(
+                img0.get(), img1.get(), timesteps
+            )
+        blend = self.blend
+        self.blend = lambda img0, img1, timestep: blend(
+            img0.get(), img1.get(), timestep
+        )
+        passthroughFrame = self.passthroughFrame
+        self.passthroughFrame = lambda frame, setupFrame: passthroughFrame(
+            frame, setupFrame.get()
+        )
@@ -1,8 +1,109 @@
 from scenedetect import AdaptiveDetector, open_video
 from tqdm import tqdm
 import cv2
+import os
+import re
+import subprocess
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 
+from .SceneDetectCache import SceneDetectCache
+from .Util import currentDirectory, log
+
+# scdet scores a frame 0-100 on how different it is from the last frame, its default threshold is 10.
+# this maps the default sensitivity of 3.0 to that, lower sensitivity still means more scene changes
+SCDET_THRESHOLD_PER_SENSITIVITY = 10 / 3
+# frames each range is read past its edges when detecting in parallel, the detector needs the frames around a cut to compare it to
+PYSCENEDETECT_RANGE_OVERLAP = 30
+# the default min_scene_len of AdaptiveDetector
+PYSCENEDETECT_MIN_SCENE_LENGTH = 15
+
+
+def detectPySceneDetectRange(
+    inputFile: str,
+    sceneChangeSensitivity: float,
+    startFrame: int,
+    endFrame: int,
+    showProgress: bool = False,
+) -> list[int]:
+    """
+    Runs pyscenedetect on the frames startFrame to endFrame, and returns the transitions in that range.
+    Reading starts PYSCENEDETECT_RANGE_OVERLAP frames early and goes as far past the end, so cuts at the edges of the range are detected the same as anywhere else.
+    This is called inside of a worker process when detecting in parallel.
+    """
+    sceneChangeList = []
+    adaptiveDetector = AdaptiveDetector(adaptive_threshold=sceneChangeSensitivity)
+    openedVideo = open_video(inputFile)
+    frame_count = openedVideo.duration.frame_num
+    readFrom = max(0, startFrame - PYSCENEDETECT_RANGE_OVERLAP)
+    readTo = min(frame_count - 1, endFrame + PYSCENEDETECT_RANGE_OVERLAP)
+    if readFrom > 0:
+        openedVideo.seek(readFrom)
+    for frame_num in tqdm(range(readFrom, readTo), disable=not showProgress):
+        frame = openedVideo.read()
+        if frame is False:
+            break
+        frame = cv2.resize(
+            frame, dsize=(100, 100)
+        )  # downscaling makes no difference in quality for scene change, bottlenecked by resize speed
+        detectedFrameList = adaptiveDetector.process_frame(
+            frame_num=frame_num, frame_img=frame
+        )
+        match len(detectedFrameList):
+            case 1:
+                transition = detectedFrameList[0] - 1
+                if startFrame <= transition < endFrame:
+                    sceneChangeList.append(transition)
+    return sceneChangeList
+
+
+# the size of the frames ffmpeg scales to for the thumbnail method, and the number of frames scored at once
+THUMBNAIL_WIDTH = 128
+THUMBNAIL_HEIGHT = 72
+THUMBNAIL_BATCH_SIZE = 256
+
+
+def adaptiveSceneChanges(
+    contentValues: np.ndarray,
+    sceneChangeSensitivity: float,
+    windowWidth: int = 2,
+    minContentValue: float = 15.0,
+    minSceneLength: int = 15,
+) -> list[int]:
+    """
+    Finds the scene changes in an array of content values, the same way InlineSceneDetect does, but over the whole video at once.
+    contentValues[n] is the score of frame n against frame n - 1, frame 0 has no score.
+    Returns the frames that start a new scene.
+    """
+    kernel = np.ones(windowWidth * 2 + 1)
+    kernel[windowWidth] = 0
+    # frame 0 is left out of the window averages, like the frames past the end of the video
+    scored = np.ones(len(contentValues))
+    scored[:1] = 0
+    windowSums = np.convolve(contentValues * scored, kernel, mode="same")
+    windowCounts = np.convolve(scored, kernel, mode="same")
+    averageContentValues = np.where(
+        windowCounts > 0, windowSums / np.maximum(windowCounts, 1), 0.0
+    )
+    adaptiveRatios = np.minimum(
+        contentValues / np.maximum(averageContentValues, 1e-5), 255.0
+    )
+    candidates = np.flatnonzero(
+        (scored > 0)
+        & (contentValues >= minContentValue)
+        & (adaptiveRatios >= sceneChangeSensitivity)
+    )
+    # only the candidates are walked in python, to keep the scenes at least minSceneLength long
+    sceneChanges = []
+    for frame in candidates.tolist():
+        if sceneChanges and frame - sceneChanges[-1] < minSceneLength:
+            continue
+        sceneChanges.append(frame)
+    return sceneChanges
+
 
 class SceneDetect:
     """
@@ -10,6 +111,8 @@ class SceneDetect:
     sceneChangeSsensitivity: This dictates the sensitivity where a scene detect between frames is activated
         - Lower means it is more suseptable to triggering a scene change
         -
+    useCache: Keep the detected transitions on disk, keyed by the video and these settings
+    workers: The number of processes pyscenedetect runs in, each one detects an even time range of the video
     """
 
     def __init__(
@@ -17,38 +120,322 @@ class SceneDetect:
         inputFile: str,
         sceneChangeSensitivity: float = 3.0,
         sceneChangeMethod: str = "pyscenedetect",
+        useCache: bool = True,
+        workers: int = 1,
     ):
         self.inputFile = inputFile
         self.sceneChangeSensitivity = sceneChangeSensitivity
         self.sceneChangeMethod = sceneChangeMethod
+        self.useCache = useCache
+        self.workers = max(1, workers)
 
-    def getPySceneDetectTransitions(self) -> Queue:
-        sceneChangeStack = Queue()
-        adaptiveDetector = AdaptiveDetector(
-            adaptive_threshold=self.sceneChangeSensitivity
-        )
+    def getPySceneDetectTransitions(self) -> list[int]:
         openedVideo = open_video(self.inputFile)
         frame_count = openedVideo.duration.frame_num
-        for frame_num in tqdm(range(frame_count - 1)):
-            frame = openedVideo.read()
-            frame = cv2.resize(
-                frame, dsize=(100, 100)
-            )  # downscaling makes no difference in quality for scene change, bottlenecked by resize speed
-            detectedFrameList = adaptiveDetector.process_frame(
-                frame_num=frame_num, frame_img=frame
+        if self.workers <= 1:
+            return detectPySceneDetectRange(
+                self.inputFile,
+                self.sceneChangeSensitivity,
+                0,
+                frame_count - 1,
+                showProgress=True,
             )
-            # if len(detectedFrameList) == 1:
-            #    sceneChangeList += detectedFrameList
-            match len(detectedFrameList):
-                case 1:
-                    sceneChangeStack.put(detectedFrameList[0] - 1)
-        return sceneChangeStack
 
-    def getTransitions(self) -> Queue:
-        "Method that returns a list of ints where the scene changes are."
+        # split the video into even time ranges, and detect each range in its own process
+        boundaries = [
+            (frame_count - 1) * worker // self.workers
+            for worker in range(self.workers + 1)
+        ]
+        # spawn, like the segment renders, so workers do not inherit the state of the main process
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            rangeTransitions = executor.map(
+                detectPySceneDetectRange,
+                [self.inputFile] * self.workers,
+                [self.sceneChangeSensitivity] * self.workers,
+                boundaries[:-1],
+                boundaries[1:],
+            )
+            transitions = sorted(
+                transition
+                for transitions in rangeTransitions
+                for transition in transitions
+            )
+        # ranges are detected without knowing about each other, a cut right at the edge of a range can be found by both
+        sceneChangeList = []
+        for transition in transitions:
+            if (
+                sceneChangeList
+                and transition - sceneChangeList[-1] < PYSCENEDETECT_MIN_SCENE_LENGTH
+            ):
+                continue
+            sceneChangeList.append(transition)
+        return sceneChangeList
+
+    def getFFmpegTransitions(self) -> list[int]:
+        """
+        Runs ffmpeg's scdet filter on a downscaled copy of the video, ffmpeg decodes and filters on multiple threads.
+        Only frames that scdet marks as a scene change are printed, with the number of the frame that starts the new scene.
+        """
+        threshold = self.sceneChangeSensitivity * SCDET_THRESHOLD_PER_SENSITIVITY
+        command = [
+            f"{os.path.join(currentDirectory(),'bin','ffmpeg')}",
+            "-i",
+            f"{self.inputFile}",
+            "-map",
+            "0:v:0",
+            "-an",
+            "-sn",
+            "-vf",
+            f"scale=256:-2:flags=fast_bilinear,scdet=threshold={threshold},"
+            + "metadata=mode=print:key=lavfi.scd.time:file=-",
+            "-f",
+            "null",
+            "-",
+        ]
+        log("Detecting scene changes with ffmpeg: " + " ".join(command))
+        output = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        ).stdout
+        # the frame before the new scene, like the transitions from pyscenedetect
+        return [
+            int(frame) - 1
+            for frame in re.findall(r"^frame:(\d+)", output, flags=re.MULTILINE)
+            if int(frame) > 0
+        ]
 
+    def detectTransitions(self) -> list[int]:
         if self.sceneChangeMethod == "pyscenedetect":
             return self.getPySceneDetectTransitions()
+        if self.sceneChangeMethod == "ffmpeg":
+            return self.getFFmpegTransitions()
+        if self.sceneChangeMethod == "thumbnail":
+            return self.getThumbnailTransitions()
+        return []
+
+    def getThumbnailTransitions(self) -> list[int]:
+        """
+        Has ffmpeg scale the frames down to thumbnails as it decodes, so python never touches a full size frame.
+        The thumbnails are read in batches, and scored with numpy against the frame before them.
+        """
+        command = [
+            f"{os.path.join(currentDirectory(),'bin','ffmpeg')}",
+            "-i",
+            f"{self.inputFile}",
+            "-map",
+            "0:v:0",
+            "-an",
+            "-sn",
+            "-vf",
+            f"scale={THUMBNAIL_WIDTH}:{THUMBNAIL_HEIGHT}:flags=area",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-loglevel",
+            "error",
+            "-",
+        ]
+        log("Detecting scene changes on thumbnails: " + " ".join(command))
+        frameSize = THUMBNAIL_WIDTH * THUMBNAIL_HEIGHT * 3
+        readProcess = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        contentValues = []
+        previousHsv = None
+        while True:
+            chunk = readProcess.stdout.read(frameSize * THUMBNAIL_BATCH_SIZE)
+            frames = len(chunk) // frameSize
+            if frames == 0:
+                break
+            hsv = rgbToHsv(
+                np.frombuffer(chunk, dtype=np.uint8, count=frames * frameSize).reshape(
+                    frames, THUMBNAIL_HEIGHT, THUMBNAIL_WIDTH, 3
+                )
+            )
+            if previousHsv is None:
+                contentValues.append(np.zeros(1))
+            else:
+                hsv = np.concatenate((previousHsv, hsv))
+            contentValues.append(np.mean(np.abs(np.diff(hsv, axis=0)), axis=(1, 2, 3)))
+            previousHsv = hsv[-1:]
+        readProcess.stdout.close()
+        readProcess.wait()
+        if not contentValues:
+            return []
+        # the frame before the new scene, like the transitions from pyscenedetect
+        return [
+            frame - 1
+            for frame in adaptiveSceneChanges(
+                np.concatenate(contentValues), self.sceneChangeSensitivity
+            )
+        ]
+
+    def getTransitionList(self) -> list[int]:
+        """
+        Method that returns a list of ints where the scene changes are.
+        The transitions are cached, so detecting on the same video with the same settings again is instant.
+        """
+        if self.sceneChangeMethod not in ("pyscenedetect", "ffmpeg", "thumbnail"):
+            return []
+        if not self.useCache:
+            return self.detectTransitions()
+        cache = SceneDetectCache()
+        key = cache.getKey(
+            self.inputFile, self.sceneChangeMethod, self.sceneChangeSensitivity
+        )
+        transitions = cache.get(key)
+        if transitions is not None:
+            log(f"Using {len(transitions)} cached transitions")
+            return transitions
+        transitions = self.detectTransitions()
+        cache.put(key, transitions)
+        return transitions
+
+    def getTransitions(self) -> Queue:
+        "Method that returns a queue of ints where the scene changes are, in the order they happen."
+        sceneChangeStack = Queue()
+        for transition in self.getTransitionList():
+            sceneChangeStack.put(transition)
+        return sceneChangeStack
+
+
+def rgbToHsv(frame: np.ndarray) -> np.ndarray:
+    """
+    Converts an rgb24 frame to hsv with the same ranges as opencv (h 0-180, s and v 0-255), as float32
+    """
+    rgb = frame.astype(np.float32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    value = rgb.max(axis=-1)
+    delta = value - rgb.min(axis=-1)
+    safeDelta = np.where(delta == 0, 1, delta)
+    saturation = np.where(value > 0, delta * 255 / np.where(value == 0, 1, value), 0)
+    hue = np.where(
+        value == r,
+        60 * (g - b) / safeDelta,
+        np.where(
+            value == g,
+            120 + 60 * (b - r) / safeDelta,
+            240 + 60 * (r - g) / safeDelta,
+        ),
+    )
+    hue = np.where(delta == 0, 0, hue % 360) / 2
+    return np.stack((hue, saturation, value), axis=-1)
+
+
+class InlineSceneDetect:
+    """
+    Detects scene changes on the frames the ffmpeg reader already decodes, so the video is not decoded a second time before rendering.
+    The reader calls process on every frame, which scores it against the frame before it, the same way pyscenedetect's AdaptiveDetector does.
+    A frame is only decided once windowWidth frames after it are scored, isTransition blocks until then, so the reader has to stay that far ahead of the render.
+
+    Args:
+        width (int): The width of the frames.
+        height (int): The height of the frames.
+        sceneChangeSensitivity (float, optional): The ratio of a frames score to the average score around it that is a scene change. Defaults to 3.0.
+        windowWidth (int, optional): The number of frames before and after a frame that it is compared to. Defaults to 2.
+        minContentValue (float, optional): The score a frame needs to be a scene change, no matter how still the frames around it are. Defaults to 15.0.
+        minSceneLength (int, optional): The minimum number of frames between scene changes. Defaults to 15.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        sceneChangeSensitivity: float = 3.0,
+        windowWidth: int = 2,
+        minContentValue: float = 15.0,
+        minSceneLength: int = 15,
+    ):
+        self.width = width
+        self.height = height
+        self.sceneChangeSensitivity = sceneChangeSensitivity
+        self.windowWidth = windowWidth
+        self.minContentValue = minContentValue
+        self.minSceneLength = minSceneLength
+        # scoring about 128 pixels across is plenty, like the 100x100 resize done for pyscenedetect
+        self.downsample = max(1, width // 128)
+        self.frameSize = width * height * 3
+        # the score of every frame against the one before it, frame 0 has no score
+        self.contentValues = []
+        self.previousHsv = None
+        self.sceneChanges = set()
+        self.lastSceneChange = None
+        self.decidedFrames = 0  # every frame below this is decided
+        self.finished = False
+        self.condition = threading.Condition()
+
+    def process(self, frame):
+        """
+        Scores the next frame in the video, frame is the raw rgb24 bytes from ffmpeg
+        """
+        if len(frame) != self.frameSize:
+            # a short read at the end of the video, keep the frame numbers in line
+            contentValue = 0.0
+        else:
+            hsv = rgbToHsv(
+                np.frombuffer(frame, dtype=np.uint8).reshape(
+                    self.height, self.width, 3
+                )[:: self.downsample, :: self.downsample]
+            )
+            if self.previousHsv is None:
+                contentValue = 0.0
+            else:
+                contentValue = float(np.mean(np.abs(hsv - self.previousHsv)))
+            self.previousHsv = hsv
+        with self.condition:
+            self.contentValues.append(contentValue)
+            self.decide(len(self.contentValues) - 1 - self.windowWidth)
+            self.condition.notify_all()
+
+    def finish(self):
+        """
+        Called once the last frame is read, the frames at the end are decided with the frames that are left
+        """
+        with self.condition:
+            self.decide(len(self.contentValues) - 1)
+            self.finished = True
+            self.condition.notify_all()
+
+    def decide(self, lastFrame: int):
+        """
+        Decides every frame up to and including lastFrame
+        """
+        while self.decidedFrames <= lastFrame:
+            frame = self.decidedFrames
+            if frame > 0 and self.isSceneChange(frame):
+                self.sceneChanges.add(frame)
+                self.lastSceneChange = frame
+            self.decidedFrames += 1
+
+    def isSceneChange(self, frame: int) -> bool:
+        contentValue = self.contentValues[frame]
+        if contentValue < self.minContentValue:
+            return False
+        if (
+            self.lastSceneChange is not None
+            and frame - self.lastSceneChange < self.minSceneLength
+        ):
+            return False
+        window = (
+            self.contentValues[max(1, frame - self.windowWidth) : frame]
+            + self.contentValues[frame + 1 : frame + self.windowWidth + 1]
+        )
+        averageContentValue = sum(window) / len(window) if window else 0.0
+        adaptiveRatio = min(contentValue / max(averageContentValue, 1e-5), 255.0)
+        return adaptiveRatio >= self.sceneChangeSensitivity
+
+    def isTransition(self, pair: int) -> bool:
+        """
+        Returns if the pair (pair, pair + 1) crosses a scene change, blocks until the reader has scored enough frames to know
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.decidedFrames > pair + 1 or self.finished
+            )
+            return pair + 1 in self.sceneChanges
 
 
 if __name__ == "__main__":
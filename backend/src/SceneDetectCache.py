@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+
+from .Util import cacheDirectory, log
+
+# the number of evenly spaced blocks of the file that are hashed, and their size
+FINGERPRINT_BLOCKS = 16
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+
+def fingerprintFile(inputFile: str) -> dict:
+    """
+    A fast fingerprint of a file, its size, modification time, and a hash of blocks sampled across it.
+    Reading the whole file would take about as long as decoding it.
+    """
+    stat = os.stat(inputFile)
+    blake2b = hashlib.blake2b(digest_size=16)
+    with open(inputFile, "rb") as f:
+        for block in range(FINGERPRINT_BLOCKS):
+            f.seek(stat.st_size * block // FINGERPRINT_BLOCKS)
+            blake2b.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return {
+        "size": stat.st_size,
+        "modified": stat.st_mtime_ns,
+        "sampledHash": blake2b.hexdigest(),
+    }
+
+
+class SceneDetectCache:
+    """
+    Keeps detected transitions on disk, so rendering the same video again skips scene detection.
+    Entries are keyed by the fingerprint of the video, the detection method and the sensitivity.
+    Once the cache is over maxSize bytes, the least recently used entries are removed.
+
+    Args:
+        directory (str, optional): Where the entries are stored. Defaults to the cache folder in the current directory.
+        maxSize (int, optional): The size of the cache in bytes. Defaults to 16MB.
+    """
+
+    def __init__(self, directory: str = None, maxSize: int = 16 * 1024 * 1024):
+        self.directory = os.path.join(
+            cacheDirectory() if directory is None else directory, "scenedetect"
+        )
+        self.maxSize = maxSize
+
+    def getKey(self, inputFile: str, method: str, sensitivity: float) -> str:
+        return hashlib.sha256(
+            json.dumps(
+                {
+                    "file": fingerprintFile(inputFile),
+                    "method": method,
+                    "sensitivity": sensitivity,
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+
+    def entryPath(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> list[int]:
+        """
+        Returns the cached transitions, or None if they are not cached
+        """
+        path = self.entryPath(key)
+        try:
+            with open(path, "r") as f:
+                transitions = json.load(f)["transitions"]
+        except (OSError, ValueError, KeyError):
+            return None
+        # the modification time is used to track when an entry was last used
+        os.utime(path)
+        return transitions
+
+    def put(self, key: str, transitions: list[int]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entryPath(key)
+        # write to a temporary file first, so a crash never leaves a half written entry
+        tempPath = path + ".tmp"
+        with open(tempPath, "w") as f:
+            json.dump({"transitions": transitions}, f)
+        os.replace(tempPath, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in maxSize
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+        totalSize = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if totalSize <= self.maxSize:
+                break
+            log(f"Removing scene detect cache entry {name}")
+            os.remove(os.path.join(self.directory, name))
+            totalSize -= size
@@ -0,0 +1,104 @@
+import threading
+
+from .Util import log, printAndLog
+
+LITE_TIER = "lite"
+FULL_TIER = "full"
+# scenes on the lite model are measured again every this many pairs, a scene can start still and move later
+REMEASURE_PAIRS = 24
+
+
+class SceneModelTiers:
+    """
+    Routes the pairs of each scene to a lite or a full interpolation model, scenes are the frames between two transitions.
+    The first pair of a scene to reach a render thread measures how much the scene moves, with measureMotion,
+    scenes that move more than the threshold are interpolated with the full model, the rest with the lite model.
+    Other render threads with a pair of that scene wait for the measurement.
+    Scenes on the lite model are measured again every REMEASURE_PAIRS pairs, and move to the full model for the rest of the scene
+    once they move more than the threshold, they never move back to the lite model.
+    Pairs are counted as they reach the render threads, so with several render threads the pairs around a move can take either model.
+
+    Args:
+        measureMotion: Takes the set up frames of a pair, and returns how much the pair moves.
+        threshold (float): The motion above which a scene is interpolated with the full model.
+    """
+
+    def __init__(self, measureMotion, threshold: float):
+        self.measureMotion = measureMotion
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.measured = {}
+        self.tiers = {}
+        self.scenePairs = {}
+        self.pairs = {LITE_TIER: 0, FULL_TIER: 0}
+        self.scenes = {LITE_TIER: 0, FULL_TIER: 0}
+        self.upgradedScenes = 0
+
+    def getTier(self, scene: int, setupFrame0, setupFrame1) -> str:
+        """
+        Returns LITE_TIER or FULL_TIER for a pair of the scene, measuring the scene if it is the first pair of it,
+        or if it is on the lite model and due to be measured again
+        """
+        with self.lock:
+            measured = self.measured.get(scene)
+            first = measured is None
+            if first:
+                measured = self.measured[scene] = threading.Event()
+        if first:
+            # if the measurement fails the scene falls back to the full model, the other threads can not be left waiting
+            tier = FULL_TIER
+            try:
+                motion = self.measureMotion(setupFrame0, setupFrame1)
+                if motion <= self.threshold:
+                    tier = LITE_TIER
+                log(f"Scene {scene} moves {round(motion, 2)}, using the {tier} model")
+            finally:
+                self.tiers[scene] = tier
+                with self.lock:
+                    self.scenes[tier] += 1
+                measured.set()
+        else:
+            measured.wait()
+        with self.lock:
+            tier = self.tiers[scene]
+            scenePairs = self.scenePairs[scene] = self.scenePairs.get(scene, 0) + 1
+        if tier == LITE_TIER and scenePairs % REMEASURE_PAIRS == 0:
+            tier = self.remeasure(scene, setupFrame0, setupFrame1)
+        with self.lock:
+            self.pairs[tier] += 1
+        return tier
+
+    def remeasure(self, scene: int, setupFrame0, setupFrame1) -> str:
+        """
+        Measures a pair of a scene on the lite model again, and moves the scene to the full model if the pair moves more than the threshold
+        """
+        # as with the first measurement, a failed one moves the scene to the full model
+        tier = FULL_TIER
+        try:
+            motion = self.measureMotion(setupFrame0, setupFrame1)
+            if motion <= self.threshold:
+                tier = LITE_TIER
+        finally:
+            if tier == FULL_TIER:
+                with self.lock:
+                    upgraded = self.tiers[scene] == LITE_TIER
+                    if upgraded:
+                        self.tiers[scene] = FULL_TIER
+                        self.scenes[LITE_TIER] -= 1
+                        self.scenes[FULL_TIER] += 1
+                        self.upgradedScenes += 1
+                if upgraded:
+                    log(f"Scene {scene} moved to the {tier} model")
+        return tier
+
+    def report(self):
+        totalPairs = max(1, sum(self.pairs.values()))
+        for tier in (LITE_TIER, FULL_TIER):
+            printAndLog(
+                f"Interpolated {self.pairs[tier]} pairs ({round(100 * self.pairs[tier] / totalPairs, 1)}%) "
+                + f"in {self.scenes[tier]} scenes with the {tier} model"
+            )
+        if self.upgradedScenes:
+            printAndLog(
+                f"{self.upgradedScenes} scenes started on the {LITE_TIER} model and moved to the {FULL_TIER} model"
+            )
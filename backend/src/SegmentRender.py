@@ -0,0 +1,238 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from .FFmpeg import concatVideos
+from .SceneDetect import SceneDetect
+from .Util import currentDirectory, printAndLog, log
+
+
+def renderSegment(renderSettings: dict) -> str:
+    """
+    Runs a full Render pipeline on one segment, this is called inside of a worker process.
+    Returns the path of the rendered segment.
+    """
+    from .RenderVideo import Render
+
+    render = Render(**renderSettings)
+    render.waitForRender()
+    return renderSettings["outputFile"]
+
+
+class SegmentRender:
+    """
+    Splits the input video into segments, and renders each segment with its own Render pipeline in a process pool.
+    The rendered segments are joined with ffmpeg's concat demuxer, and the audio is muxed in once at the end.
+
+    Segment boundaries are placed on keyframes, so every reader can seek straight to its segment without decoding the frames before it.
+    When interpolating, boundaries are placed on scene changes, the pair that crosses a boundary is a scene change and is not interpolated.
+
+    Args:
+        inputFile (str): The path to the input file.
+        outputFile (str): The path to the output file.
+        segments (int): The number of segments, and the number of worker processes.
+        overwrite (bool): Overwrite existing output file if it exists.
+        sceneDetectMethod (str): The scene change detection method.
+        sceneDetectSensitivity (float): The scene change detection sensitivity.
+        **renderSettings: Any other settings, passed to every Render.
+    """
+
+    def __init__(
+        self,
+        inputFile: str,
+        outputFile: str,
+        segments: int = 2,
+        overwrite: bool = False,
+        sceneDetectMethod: str = "pyscenedetect",
+        sceneDetectSensitivity: float = 3.0,
+        **renderSettings,
+    ):
+        self.inputFile = inputFile
+        self.outputFile = outputFile
+        self.segments = segments
+        self.overwrite = overwrite
+        self.sceneDetectMethod = sceneDetectMethod
+        self.sceneDetectSensitivity = sceneDetectSensitivity
+        self.renderSettings = renderSettings
+        self.interpolating = renderSettings.get("interpolateModel") is not None
+
+        cap = cv2.VideoCapture(inputFile)
+        self.totalInputFrames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+
+        self.render()
+
+    def getKeyframes(self) -> list[int]:
+        """
+        Gets the frame numbers of every keyframe, only the keyframes are decoded so this is fast.
+        """
+        command = [
+            f"{os.path.join(currentDirectory(),'bin','ffmpeg')}",
+            "-skip_frame",
+            "nokey",
+            "-i",
+            f"{self.inputFile}",
+            "-map",
+            "0:v:0",
+            "-vf",
+            "showinfo",
+            "-f",
+            "null",
+            "-",
+        ]
+        output = subprocess.run(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        ).stderr
+        times = [float(time) for time in re.findall(r"pts_time:\s*(-?[\d.]+)", output)]
+        if not times:
+            return [0]
+        # timestamps may not start at 0, the first frame is always a keyframe
+        return sorted({round((time - times[0]) * self.fps) for time in times})
+
+    def getSegmentBoundaries(self, candidates: list[int]) -> list[int]:
+        """
+        Picks the candidate frames closest to an even split of the video, returns the first frame of every segment.
+        """
+        # a segment should not be tiny, it would just add another model to load
+        minimumLength = max(1, self.totalInputFrames // (self.segments * 4))
+        boundaries = [0]
+        for segment in range(1, self.segments):
+            target = self.totalInputFrames * segment / self.segments
+            validCandidates = [
+                candidate
+                for candidate in candidates
+                if candidate >= boundaries[-1] + minimumLength
+                and candidate <= self.totalInputFrames - minimumLength
+            ]
+            if not validCandidates:
+                break
+            boundaries.append(
+                min(validCandidates, key=lambda candidate: abs(candidate - target))
+            )
+        return boundaries
+
+    def shareModelWeights(self, directory: str) -> dict:
+        """
+        Loads each model once, and writes its weights to directory, every segment maps them from there instead of loading its own copy.
+        So the memory the weights use, and the time it takes to load them, stay the same with more segments.
+        Returns the render settings that point the segments to the weights, only the pytorch backend can use them.
+        """
+        if self.renderSettings.get("backend", "pytorch") != "pytorch":
+            return {}
+        from .SharedWeights import writeSharedWeights, precisionToDtype
+
+        dtype = precisionToDtype(self.renderSettings.get("precision", "auto"))
+        sharedWeights = {}
+        upscaleModel = self.renderSettings.get("upscaleModel")
+        if upscaleModel:
+            from .UpscaleTorch import getUpscaleStateDict
+
+            path = os.path.join(directory, "upscale_weights.pt")
+            writeSharedWeights(getUpscaleStateDict(upscaleModel), path, dtype)
+            sharedWeights["sharedUpscaleWeights"] = path
+        interpolateModel = self.renderSettings.get("interpolateModel")
+        if interpolateModel:
+            from .InterpolateTorch import getIFNetStateDict
+
+            path = os.path.join(directory, "interpolate_weights.pt")
+            writeSharedWeights(getIFNetStateDict(interpolateModel), path, dtype)
+            sharedWeights["sharedInterpolateWeights"] = path
+        return sharedWeights
+
+    def render(self):
+        printAndLog("Probing keyframes")
+        keyframes = self.getKeyframes()
+        transitions = []
+        # inline detection runs in each segment's own reader, so it can not be used to place the boundaries
+        detectUpFront = self.sceneDetectMethod not in ("none", "inline")
+        if self.interpolating and detectUpFront:
+            printAndLog("Detecting Transitions")
+            transitions = SceneDetect(
+                inputFile=self.inputFile,
+                sceneChangeSensitivity=self.sceneDetectSensitivity,
+                sceneChangeMethod=self.sceneDetectMethod,
+                workers=self.renderSettings.get("sceneDetectWorkers", 1),
+            ).getTransitionList()
+
+        if self.interpolating and detectUpFront:
+            # a transition n is the pair (n, n+1), so the new scene starts at n+1
+            sceneStarts = [transition + 1 for transition in transitions]
+            keyframeSet = set(keyframes)
+            sceneStartKeyframes = [
+                frame for frame in sceneStarts if frame in keyframeSet
+            ]
+            if len(sceneStartKeyframes) >= self.segments - 1:
+                candidates = sceneStartKeyframes
+            else:
+                candidates = sceneStarts
+        else:
+            candidates = keyframes
+
+        boundaries = self.getSegmentBoundaries(candidates)
+        if len(boundaries) < self.segments:
+            printAndLog(
+                f"Only found {len(boundaries)} usable segment boundaries, rendering {len(boundaries)} segments"
+            )
+        log(f"Segment boundaries: {boundaries}")
+
+        tempDirectory = tempfile.mkdtemp(
+            prefix="rve_segments_",
+            dir=os.path.dirname(os.path.abspath(self.outputFile)),
+        )
+        extension = os.path.splitext(self.outputFile)[1]
+        sharedWeights = self.shareModelWeights(tempDirectory)
+        segmentSettings = []
+        for segment, startFrame in enumerate(boundaries):
+            if segment < len(boundaries) - 1:
+                # the reader reads frameCount - 1 frames, when interpolating the segment also reads the first frame of the next segment,
+                # so the pair that crosses the boundary is rendered by this segment
+                frameCount = boundaries[segment + 1] - startFrame + 1
+                if self.interpolating:
+                    frameCount += 1
+            else:
+                frameCount = self.totalInputFrames - startFrame
+            settings = dict(self.renderSettings)
+            settings.update(
+                inputFile=self.inputFile,
+                outputFile=os.path.join(tempDirectory, f"segment_{segment:04d}{extension}"),
+                overwrite=True,
+                sharedMemoryID=None,
+                startFrame=startFrame,
+                frameCount=frameCount,
+                copyAudio=False,
+                sceneDetectMethod=self.sceneDetectMethod,
+                sceneDetectSensitivity=self.sceneDetectSensitivity,
+                **sharedWeights,
+            )
+            if self.interpolating and detectUpFront:
+                settings["sceneTransitions"] = [
+                    transition - startFrame
+                    for transition in transitions
+                    if 0 <= transition - startFrame < frameCount - 1
+                ]
+            segmentSettings.append(settings)
+
+        printAndLog(f"Rendering {len(segmentSettings)} segments")
+        try:
+            # spawn, as cuda can not be used in a forked process
+            with ProcessPoolExecutor(
+                max_workers=len(segmentSettings),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                segmentFiles = list(executor.map(renderSegment, segmentSettings))
+            printAndLog("Joining segments")
+            concatVideos(
+                segmentFiles,
+                self.outputFile,
+                audioFile=self.inputFile,
+                overwrite=self.overwrite,
+            )
+        finally:
+            shutil.rmtree(tempDirectory, ignore_errors=True)
@@ -0,0 +1,164 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .Util import log
+
+# descriptor flags
+FLAG_END_OF_STREAM = 1
+# descriptors are (frame index, size, flags), the frames start after them, aligned to a cache line
+DESCRIPTOR_FIELDS = 3
+ALIGNMENT = 64
+
+
+class SharedFrameRing:
+    """
+    Frame buffers in shared memory, so frames move between processes by slot index instead of being pickled.
+    Every slot has a descriptor with the index of the frame in it, the number of bytes that are used, and flags.
+    Free slots and filled slots are passed around as indices on two multiprocessing queues.
+
+    Inside of the process that renders, this is used like FrameBufferRing, a received slot starts with one reference,
+    and goes back on the free queue once every user of the frame has released it.
+
+    Args:
+        frameSize (int): The size of a frame in bytes.
+        slots (int): The number of frames.
+        context: The multiprocessing context the queues are made with, it has to match the processes that use the ring.
+    """
+
+    def __init__(self, frameSize: int, slots: int, context):
+        self.frameSize = frameSize
+        self.slots = slots
+        self.freeSlots = context.Queue()
+        self.filledSlots = context.Queue()
+        for slot in range(slots):
+            self.freeSlots.put(slot)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.getOffset(slots) + frameSize * slots
+        )
+        self.owner = True
+        self.mapBuffers()
+
+    @classmethod
+    def attach(cls, name: str, frameSize: int, slots: int, freeSlots, filledSlots):
+        """
+        Opens a ring that was made by another process, the arguments come from getAttachArgs
+        """
+        ring = cls.__new__(cls)
+        ring.frameSize = frameSize
+        ring.slots = slots
+        ring.freeSlots = freeSlots
+        ring.filledSlots = filledSlots
+        try:
+            ring.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before python 3.13 it is always tracked, processes started by multiprocessing share the tracker of the owner, so it is only tracked once
+            ring.shm = shared_memory.SharedMemory(name=name)
+        ring.owner = False
+        ring.mapBuffers()
+        return ring
+
+    def getAttachArgs(self) -> tuple:
+        return (
+            self.shm.name,
+            self.frameSize,
+            self.slots,
+            self.freeSlots,
+            self.filledSlots,
+        )
+
+    def getOffset(self, slots: int) -> int:
+        descriptorSize = slots * DESCRIPTOR_FIELDS * 8
+        return -(-descriptorSize // ALIGNMENT) * ALIGNMENT
+
+    def mapBuffers(self):
+        offset = self.getOffset(self.slots)
+        self.descriptors = np.ndarray(
+            (self.slots, DESCRIPTOR_FIELDS), dtype=np.int64, buffer=self.shm.buf
+        )
+        self.views = [
+            self.shm.buf[
+                offset + slot * self.frameSize : offset + (slot + 1) * self.frameSize
+            ]
+            for slot in range(self.slots)
+        ]
+        self.slotOfView = {id(view): slot for slot, view in enumerate(self.views)}
+        self.references = [0] * self.slots
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: float = None) -> int:
+        """
+        Waits for a free slot, to fill in and publish, raises queue.Empty if none is freed within the timeout
+        """
+        return self.freeSlots.get(timeout=timeout)
+
+    def publish(self, slot: int, frameIndex: int, size: int, flags: int = 0):
+        """
+        Fills in the descriptor of a slot, and hands it to the process on the other side
+        """
+        self.descriptors[slot] = (frameIndex, size, flags)
+        self.filledSlots.put(slot)
+
+    def publishEndOfStream(self, frameIndex: int):
+        """
+        Tells the process on the other side that no frames come after frameIndex.
+        It takes no slot, so it is sent even when the other side has stopped freeing them.
+        """
+        self.filledSlots.put((None, frameIndex))
+
+    def receive(self) -> tuple:
+        """
+        Waits for a filled slot, returns (slot, frameIndex, size, flags), the slot starts with one reference.
+        The end of the stream comes with FLAG_END_OF_STREAM, and no slot.
+        """
+        slot = self.filledSlots.get()
+        if isinstance(slot, tuple):
+            return None, slot[1], 0, FLAG_END_OF_STREAM
+        frameIndex, size, flags = (int(value) for value in self.descriptors[slot])
+        with self.lock:
+            self.references[slot] = 1
+        return slot, frameIndex, size, flags
+
+    def free(self, slot: int):
+        self.freeSlots.put(slot)
+
+    def getSlot(self, frame) -> int:
+        """
+        Returns the slot of a view from this ring, or None for any other frame
+        """
+        return self.slotOfView.get(id(frame))
+
+    def retain(self, frame):
+        slot = self.getSlot(frame)
+        if slot is None:
+            return
+        with self.lock:
+            self.references[slot] += 1
+
+    def release(self, frame):
+        slot = self.getSlot(frame)
+        if slot is None:
+            return
+        with self.lock:
+            self.references[slot] -= 1
+            free = self.references[slot] == 0
+        if free:
+            self.free(slot)
+
+    def close(self):
+        """
+        Closes the shared memory in this process, the process that made the ring also removes it
+        """
+        if self.owner:
+            self.shm.unlink()
+        # the memory can only be closed once nothing points into it, otherwise it stays mapped until the process exits
+        self.slotOfView = {}
+        self.descriptors = None
+        try:
+            for view in self.views:
+                view.release()
+            self.shm.close()
+        except BufferError as e:
+            log(f"Shared frame ring is still in use: {e}")
+        self.views = []
@@ -0,0 +1,42 @@
+import torch
+
+from .Util import check_bfloat16_support, log
+
+
+def precisionToDtype(precision: str) -> torch.dtype:
+    """
+    The dtype a model renders in, the same as the handlePrecision of the pytorch models
+    """
+    if precision == "auto":
+        return torch.float16 if check_bfloat16_support() else torch.float32
+    if precision == "float32":
+        return torch.float32
+    if precision == "float16":
+        return torch.float16
+
+
+def writeSharedWeights(stateDict: dict, path: str, dtype: torch.dtype):
+    """
+    Writes the weights of a model to a plain torch file, for every render process to map with loadSharedWeights.
+    Floating point weights are converted to the dtype the model renders in, so the processes never convert, and with that copy, them.
+    """
+    torch.save(
+        {
+            key: (
+                value.to(device="cpu", dtype=dtype)
+                if value.is_floating_point()
+                else value.cpu()
+            )
+            for key, value in stateDict.items()
+        },
+        path,
+    )
+    log(f"Wrote shared weights to {path}")
+
+
+def loadSharedWeights(path: str) -> dict:
+    """
+    Maps the weights written by writeSharedWeights, the pages of the file are shared with every other process that maps it.
+    The weights have to be assigned to the model, and only read, a write gives the process its own copy of the page.
+    """
+    return torch.load(path, map_location="cpu", weights_only=True, mmap=True)
@@ -0,0 +1,76 @@
+import math
+
+# rough cost of a model call per pixel it runs on, relative to each other.
+# upscaling models run a lot more convolutions per pixel than the rife flow blocks, which mostly run on downscaled images
+UPSCALE_COST_PER_PIXEL = 4.0
+INTERPOLATE_COST_PER_PIXEL = 1.0
+# rife needs memory for flows and warps at full resolution, above this it is always run before upscaling
+MAX_INTERPOLATE_PIXELS = 7680 * 4320
+# (most padded pixels, flow scale) for the auto flow scale, larger frames estimate the flow at 0.25
+AUTO_FLOW_SCALES = ((2560 * 1440, 1.0), (4096 * 2176, 0.5))
+
+INTERPOLATE_FIRST = "interpolate_first"
+UPSCALE_FIRST = "upscale_first"
+# not picked by planStageOrder, it trades quality for speed so it has to be asked for.
+# every input frame is upscaled, and the flow is estimated at the input resolution and used to warp the upscaled frames
+FLOW_REUSE = "flow_reuse"
+
+
+def paddedPixels(width: int, height: int, padding: int = 32) -> int:
+    """
+    Rife pads frames to a multiple of 32, so that is the size it actually runs on
+    """
+    return math.ceil(width / padding) * padding * math.ceil(height / padding) * padding
+
+
+def estimateStageCosts(
+    width: int, height: int, upscaleTimes: int, interpolateFactor: float
+) -> dict:
+    """
+    Estimates the cost of rendering one input frame with each stage order.
+    interpolate_first: interpolate at the input resolution, then upscale every output frame
+    upscale_first: upscale every input frame, then interpolate at the upscaled resolution
+    """
+    # frames that are generated for each pair on average, about one frame per pair is a source frame
+    interpolatedFrames = max(interpolateFactor - 1, 0)
+    inputPixels = width * height
+    return {
+        INTERPOLATE_FIRST: interpolatedFrames
+        * paddedPixels(width, height)
+        * INTERPOLATE_COST_PER_PIXEL
+        + interpolateFactor * inputPixels * UPSCALE_COST_PER_PIXEL,
+        UPSCALE_FIRST: inputPixels * UPSCALE_COST_PER_PIXEL
+        + interpolatedFrames
+        * paddedPixels(width * upscaleTimes, height * upscaleTimes)
+        * INTERPOLATE_COST_PER_PIXEL,
+    }
+
+
+def planStageOrder(
+    width: int, height: int, upscaleTimes: int, interpolateFactor: float
+) -> str:
+    """
+    Picks the cheaper order to run upscaling and interpolation in, when both are done in a single pass.
+    Returns INTERPOLATE_FIRST or UPSCALE_FIRST.
+    """
+    if (
+        paddedPixels(width * upscaleTimes, height * upscaleTimes)
+        > MAX_INTERPOLATE_PIXELS
+    ):
+        return INTERPOLATE_FIRST
+    costs = estimateStageCosts(width, height, upscaleTimes, interpolateFactor)
+    return min(costs, key=costs.get)
+
+
+def getFlowScale(width: int, height: int, flowScale=1.0) -> float:
+    """
+    Returns the resolution rife estimates the flow at, relative to the frames, the frames are always warped at full resolution.
+    auto picks it from the padded size of the frames, the coarse blocks gain little from the detail of large frames.
+    """
+    if flowScale != "auto":
+        return float(flowScale)
+    pixels = paddedPixels(width, height)
+    for maxPixels, scale in AUTO_FLOW_SCALES:
+        if pixels <= maxPixels:
+            return scale
+    return 0.25
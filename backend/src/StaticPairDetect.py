@@ -0,0 +1,92 @@
+import numpy as np
+
+from .Util import printAndLog
+
+# returned by check when frame1 of the pair is the same as frame0, it is repeated for every timestep
+IDENTICAL_PAIR = "identical_pair"
+# returned by check when the pair barely moves, frame0 and frame1 are blended for every timestep
+STATIC_PAIR = "static_pair"
+
+
+def blendFrames(frame0, frame1, timestep: float) -> bytes:
+    """
+    Blends two frames of uint8 bytes linearly, used for static pairs when the frames are set up as bytes
+    """
+    frame0 = np.frombuffer(frame0, dtype=np.uint8).astype(np.float32)
+    frame1 = np.frombuffer(frame1, dtype=np.uint8).astype(np.float32)
+    return (frame0 + (frame1 - frame0) * timestep).round().astype(np.uint8).tobytes()
+
+
+class StaticPairDetector:
+    """
+    Finds pairs of frames that do not need to go through the interpolation model, like slides, credits or a talking head that holds still.
+    The motion of a pair is the mean absolute difference of the downsampled frames, pairs under the threshold are blended instead.
+    Pairs where the downsampled frames match exactly are compared in full, and the frame is repeated if they are identical.
+    Frames have to be checked in order, each one is compared to the frame checked before it.
+    The last checked frame is kept in previousFrame, so the caller has to keep its buffer until the next frame is checked.
+
+    Args:
+        width (int): The width of the frames.
+        height (int): The height of the frames.
+        threshold (float, optional): Mean absolute difference (0-255) under which a pair is static. Defaults to 1.0.
+        downsample (int, optional): Only every nth pixel in each direction is compared. Defaults to 8.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        threshold: float = 1.0,
+        downsample: int = 8,
+    ):
+        self.width = width
+        self.height = height
+        self.threshold = threshold
+        self.downsample = downsample
+        self.previousFrame = None
+        self.previousThumbnail = None
+        self.totalPairs = 0
+        self.identicalPairs = 0
+        self.staticPairs = 0
+
+    def thumbnail(self, frame) -> np.ndarray:
+        return (
+            np.frombuffer(frame, dtype=np.uint8)
+            .reshape(self.height, self.width, 3)[:: self.downsample, :: self.downsample]
+            .astype(np.int16)
+        )
+
+    def check(self, frame):
+        """
+        Returns IDENTICAL_PAIR or STATIC_PAIR for the pair of the last checked frame and this one,
+        or None if the pair has to be interpolated, or if this is the first frame
+        """
+        thumbnail = self.thumbnail(frame)
+        previousFrame = self.previousFrame
+        previousThumbnail = self.previousThumbnail
+        self.previousFrame = frame
+        self.previousThumbnail = thumbnail
+        if previousThumbnail is None:
+            return None
+
+        self.totalPairs += 1
+        difference = np.abs(thumbnail - previousThumbnail)
+        # the full frames are only compared when the downsampled ones can not tell them apart, a change can miss every sampled pixel
+        if not difference.any() and np.array_equal(
+            np.frombuffer(frame, dtype=np.uint8),
+            np.frombuffer(previousFrame, dtype=np.uint8),
+        ):
+            self.identicalPairs += 1
+            return IDENTICAL_PAIR
+        if np.mean(difference) <= self.threshold:
+            self.staticPairs += 1
+            return STATIC_PAIR
+        return None
+
+    def report(self):
+        skipped = self.identicalPairs + self.staticPairs
+        skipRate = 100 * skipped / max(1, self.totalPairs)
+        printAndLog(
+            f"Skipped the model for {skipped} of {self.totalPairs} pairs ({round(skipRate, 1)}%), "
+            + f"{self.identicalPairs} identical, {self.staticPairs} blended"
+        )
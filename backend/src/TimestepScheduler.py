@@ -0,0 +1,37 @@
+import math
+from fractions import Fraction
+
+
+class TimestepScheduler:
+    """
+    Maps every output frame to the pair of source frames it falls between, and the exact timestep inside of that pair.
+    Output frame n (counting from 1) sits at source position n / interpolateFactor, the first source frame is not written out.
+    With an integer factor this gives the same frames as before, 1/factor, 2/factor, ..., 1 for every pair.
+    With a fractional factor, only the frames that end up in the output are scheduled, instead of rounding the factor up and letting ffmpeg drop the extras.
+
+    Args:
+        interpolateFactor (float): The multiplier for the framerate.
+    """
+
+    def __init__(self, interpolateFactor: float = 1):
+        # exact fractions, so timesteps of 1 are exact and no frame is skipped or doubled by float rounding
+        self.interpolateFactor = Fraction(interpolateFactor).limit_denominator(1000)
+
+    def outputFramesBefore(self, pair: int) -> int:
+        """
+        Returns the number of output frames that come before the pair, which is also the output frame count of a video with pair + 1 frames
+        """
+        return math.floor(pair * self.interpolateFactor)
+
+    def getTimesteps(self, pair: int) -> list[float]:
+        """
+        Returns the timesteps of every output frame between frame pair and frame pair + 1, in order.
+        A timestep of 1 is the source frame pair + 1 itself, a pair can have no output frames when the factor is below 1.
+        """
+        return [
+            float(outputFrame / self.interpolateFactor - pair)
+            for outputFrame in range(
+                self.outputFramesBefore(pair) + 1,
+                self.outputFramesBefore(pair + 1) + 1,
+            )
+        ]
@@ -74,7 +74,8 @@ class UpscaleNCNN:
         self.scale = scale
 
     def Upscale(self, imageChunk):
-        output = self.model.process_bytes(imageChunk, self.width, self.height, 3)
+        # bytes does not copy a chunk that is already bytes, only views into the read buffers
+        output = self.model.process_bytes(bytes(imageChunk), self.width, self.height, 3)
         return np.ascontiguousarray(
             np.frombuffer(
                 output,
@@ -1,5 +1,6 @@
 import os
 import math
+import itertools
 import numpy as np
 import cv2
 import torch as torch
@@ -9,8 +10,20 @@ from src.Util import (
     currentDirectory,
     modelsDirectory,
     printAndLog,
+    log,
     check_bfloat16_support,
 )
+from src.SharedWeights import loadSharedWeights
+
+
+def getUpscaleStateDict(modelPath: str) -> dict:
+    """
+    Returns the weights of a spandrel model, with the keys of the architecture it was detected as
+    """
+    from spandrel import ModelLoader
+
+    return ModelLoader().load_from_file(modelPath).model.state_dict()
+
 
 # tiling code permidently borrowed from https://github.com/chaiNNer-org/spandrel/issues/113#issuecomment-1907209731
 
@@ -28,6 +41,8 @@ class UpscalePytorch:
         backend (str, optional): The backend for inference. Defaults to "pytorch".
         trt_workspace_size (int, optional): The workspace size for TensorRT. Defaults to 0.
         trt_cache_dir (str, optional): The cache directory for TensorRT. Defaults to modelsDirectory().
+        stagingBuffers (int, optional): The number of input tensors bytesToFrame reuses, this has to cover every set up frame that is alive at once. Defaults to 2.
+        sharedWeights (str, optional): Weights written by writeSharedWeights, mapped instead of loading the model file, so processes share them. Defaults to None.
 
     Attributes:
         tile_pad (int): The padding size for tiles.
@@ -41,10 +56,12 @@ class UpscalePytorch:
     Methods:
         handlePrecision(precision): Handles the precision mode for the model.
         loadModel(modelPath, dtype, device): Loads the model from file.
-        bytesToFrame(frame): Converts bytes to a torch tensor.
-        tensorToNPArray(image): Converts a torch tensor to a NumPy array.
+        bytesToFrame(frame): Converts bytes to a torch tensor, filling in the next tensor of the staging pool.
+        tensorToNPArray(image): Quantizes a rendered torch tensor and converts it to a NumPy array.
         renderImage(image): Renders an image using the model.
         renderToNPArray(image): Renders an image and returns it as a NumPy array.
+        renderBatchToNPArrays(images): Renders a list of images in one batch and returns a list of NumPy arrays.
+        renderToTensor(image), renderBatchToTensors(images): The same, but the output stays on the device, to be converted with tensorToNPArray by another thread.
         renderImagesInDirectory(dir): Renders all images in a directory.
         getScale(): Returns the scale factor of the model.
         saveImage(image, fullOutputPathLocation): Saves an image to a file.
@@ -63,6 +80,8 @@ class UpscalePytorch:
         # trt options
         trt_workspace_size: int = 0,
         trt_cache_dir: str = modelsDirectory(),
+        stagingBuffers: int = 2,
+        sharedWeights: str = None,
     ):
         self.stream = torch.cuda.Stream()
         self.prepareStream = torch.cuda.Stream()
@@ -80,7 +99,12 @@ class UpscalePytorch:
             self.tile_pad = tile_pad
             self.dtype = self.handlePrecision(precision)
             self.device = device
-            model = self.loadModel(modelPath=modelPath, device=device, dtype=self.dtype)
+            model = self.loadModel(
+                modelPath=modelPath,
+                device=device,
+                dtype=self.dtype,
+                sharedWeights=sharedWeights,
+            )
 
             self.width = width
             self.height = height
@@ -138,6 +162,21 @@ class UpscalePytorch:
                 model = torch.jit.load(trt_engine_path)
 
             self.model = model
+
+            # set up frames are written into these in place, so no full size tensor is allocated per frame
+            self.stagingFrames = [
+                torch.empty(
+                    (1, 3, self.height, self.width), dtype=self.dtype, device=device
+                )
+                for _ in range(max(1, stagingBuffers))
+            ]
+            self.stagingIndex = 0
+            # frames are copied to the device as uint8 first, which is smaller than the converted frame
+            self.uploadFrame = None
+            if torch.device(device).type != "cpu":
+                self.uploadFrame = torch.empty(
+                    (self.height, self.width, 3), dtype=torch.uint8, device=device
+                )
         self.prepareStream.synchronize()
 
     def handlePrecision(self, precision):
@@ -150,37 +189,92 @@ class UpscalePytorch:
 
     @torch.inference_mode()
     def loadModel(
-        self, modelPath: str, dtype: torch.dtype = torch.float32, device: str = "cuda"
+        self,
+        modelPath: str,
+        dtype: torch.dtype = torch.float32,
+        device: str = "cuda",
+        sharedWeights: str = None,
     ) -> torch.nn.Module:
         from spandrel import ModelLoader, ImageModelDescriptor
 
-        model = ModelLoader().load_from_file(modelPath)
+        if sharedWeights is None:
+            model = ModelLoader().load_from_file(modelPath)
+        else:
+            # written once by the process that started this one, every process maps the same weights
+            model = self.loadSharedModel(loadSharedWeights(sharedWeights))
         assert isinstance(model, ImageModelDescriptor)
         # get model attributes
         self.scale = model.scale
 
         model = model.model
-        model.load_state_dict(model.state_dict(), assign=True)
         model.eval().to(self.device)
         if self.dtype == torch.float16:
             model.half()
         return model
 
+    def loadSharedModel(self, stateDict: dict):
+        """
+        Builds the model around the mapped weights, without a copy of them.
+        It is built on the meta device, where its own weights take no memory, then the mapped weights are assigned to it.
+        Architectures that can not be built on the meta device, or that have tensors outside of the state dict, are built on the cpu,
+        which costs one copy of the weights.
+        """
+        from spandrel import ModelLoader
+
+        try:
+            with torch.device("meta"):
+                model = ModelLoader(device=torch.device("meta")).load_from_state_dict(
+                    stateDict
+                )
+            model.model.load_state_dict(stateDict, assign=True)
+            if not any(
+                tensor.is_meta
+                for tensor in itertools.chain(
+                    model.model.parameters(), model.model.buffers()
+                )
+            ):
+                return model
+            log("The upscale model has tensors outside of its weights")
+        except (RuntimeError, NotImplementedError) as e:
+            log(f"The upscale model can not be built on the meta device: {e}")
+        model = ModelLoader().load_from_state_dict(stateDict)
+        model.model.load_state_dict(stateDict, assign=True)
+        return model
+
+    @torch.inference_mode()
     def bytesToFrame(self, frame):
-        return (
-            torch.frombuffer(frame, dtype=torch.uint8)
-            .reshape(self.height, self.width, 3)
-            .to(self.device, dtype=self.dtype)
-            .permute(2, 0, 1)
-            .unsqueeze(0)
-            .mul_(1 / 255)
-        )
+        """
+        Fills the next staging tensor with the frame, the uint8 to float conversion and the scale to 0-1 are one operation.
+        The returned tensor is overwritten once every staging tensor after it has been used.
+        """
+        with torch.cuda.stream(self.prepareStream):
+            staging = self.stagingFrames[self.stagingIndex]
+            self.stagingIndex = (self.stagingIndex + 1) % len(self.stagingFrames)
+            frame = torch.frombuffer(frame, dtype=torch.uint8).view(
+                self.height, self.width, 3
+            )
+            if self.uploadFrame is not None:
+                frame = self.uploadFrame.copy_(frame, non_blocking=True)
+            torch.mul(frame.permute(2, 0, 1), 1 / 255, out=staging[0])
+        self.prepareStream.synchronize()
+        return staging
 
+    @torch.inference_mode()
     def tensorToNPArray(self, image: torch.Tensor) -> np.array:
-        with torch.cuda.stream(self.prepareStream):
-            image =  image.squeeze(0).permute(1, 2, 0).float().mul(255).cpu().numpy()
-        self.prepareStream.syncronize()
-        return image
+        """
+        Quantizes a rendered (1, 3, H, W) tensor and copies it to the host, the same as renderToNPArray does after the model
+        """
+        return (
+            image.squeeze(0)
+            .permute(1, 2, 0)
+            .float()
+            .clamp(0.0, 1.0)
+            .mul(255)
+            .byte()
+            .contiguous()
+            .cpu()
+            .numpy()
+        )
 
     @torch.inference_mode()
     def renderImage(self, image: torch.Tensor) -> torch.Tensor:
@@ -207,6 +301,47 @@ class UpscalePytorch:
         self.stream.synchronize()
         return output
 
+    @torch.inference_mode()
+    def renderBatchToNPArrays(self, images: list[torch.Tensor]) -> list[np.ndarray]:
+        """
+        Stacks the frames into a single (N, 3, H, W) batch, runs one forward pass, and splits the output back into per-frame arrays in order
+        """
+        with torch.cuda.stream(self.stream):
+            output = self.renderImage(torch.cat(images))
+            output = (
+                output.permute(0, 2, 3, 1)
+                .float()
+                .clamp(0.0, 1.0)
+                .mul(255)
+                .byte()
+                .contiguous()
+                .detach()
+                .cpu()
+                .numpy()
+            )
+        self.stream.synchronize()
+        return list(output)
+
+    @torch.inference_mode()
+    def renderToTensor(self, image: torch.Tensor) -> torch.Tensor:
+        """
+        Renders an image, and leaves the output on the device for tensorToNPArray
+        """
+        with torch.cuda.stream(self.stream):
+            output = self.renderImage(image)
+        self.stream.synchronize()
+        return output
+
+    @torch.inference_mode()
+    def renderBatchToTensors(self, images: list[torch.Tensor]) -> list[torch.Tensor]:
+        """
+        Renders the frames in one batch like renderBatchToNPArrays, and returns the (1, 3, H, W) output of each frame on the device
+        """
+        with torch.cuda.stream(self.stream):
+            output = self.renderImage(torch.cat(images))
+        self.stream.synchronize()
+        return list(output.split(1))
+
     def getScale(self):
         return self.scale
 
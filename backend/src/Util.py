@@ -1,10 +1,13 @@
 import os
 import warnings
 import platform
+import multiprocessing
 
 cwd = os.getcwd()
-with open(os.path.join(cwd, "backend_log.txt"), "w") as f:
-    pass
+# worker processes import this too, only the main process starts a new log
+if multiprocessing.parent_process() is None:
+    with open(os.path.join(cwd, "backend_log.txt"), "w") as f:
+        pass
 
 
 def warnAndLog(message: str):
@@ -41,6 +44,10 @@ def modelsDirectory():
     return os.path.join(cwd, "models")
 
 
+def cacheDirectory():
+    return os.path.join(cwd, "cache")
+
+
 def checkForPytorch() -> bool:
     """
     function that checks if the pytorch backend is available
@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.InterpolateTorch import InterpolateRifeTorch  # noqa: E402
+
+
+class YieldingPool(list):
+    """
+    A staging pool that lets other threads run while a tensor is looked up, so calls that are not locked interleave
+    """
+
+    def __getitem__(self, index):
+        time.sleep(0.0001)
+        return super().__getitem__(index)
+
+
+def makeStagingPool(stagingBuffers: int) -> InterpolateRifeTorch:
+    """
+    Sets up only the staging pool of an InterpolateRifeTorch, without loading a model
+    """
+    interpolate = InterpolateRifeTorch.__new__(InterpolateRifeTorch)
+    interpolate.stagingFrames = YieldingPool(
+        torch.zeros((1, 3, 32, 32)) for _ in range(stagingBuffers)
+    )
+    interpolate.stagingIndex = 0
+    interpolate.stagingLock = threading.Lock()
+    interpolate.stagedFrames = 0
+    interpolate.stagingFrameIndices = {}
+    interpolate.encodedFrames = {}
+    return interpolate
+
+
+def test_nextStagingFrameFromSeveralThreads():
+    threads = 8
+    framesPerThread = 50
+    interpolate = makeStagingPool(threads)
+    barrier = threading.Barrier(threads)
+    handedOut = [[] for _ in range(threads)]
+
+    def setupFrames(thread: int):
+        barrier.wait()
+        for _ in range(framesPerThread):
+            staging = interpolate.nextStagingFrame()
+            handedOut[thread].append(
+                interpolate.getStagingFrameIndex(staging) is not None
+            )
+
+    workers = [
+        threading.Thread(target=setupFrames, args=(thread,))
+        for thread in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # every call took its own place in the pool, so the pool went round exactly once per stagingBuffers calls
+    assert interpolate.stagedFrames == threads * framesPerThread
+    assert interpolate.stagingIndex == (threads * framesPerThread) % threads
+    assert all(all(indexed) for indexed in handedOut)
+    assert sorted(
+        index for _, index in interpolate.stagingFrameIndices.values()
+    ) == list(range(threads * framesPerThread - threads, threads * framesPerThread))
+
+
+def test_nextStagingFrameConcurrentCallsGetDifferentTensors():
+    threads = 4
+    interpolate = makeStagingPool(threads)
+    barrier = threading.Barrier(threads)
+    tensors = [None] * threads
+
+    def setupFrame(thread: int):
+        barrier.wait()
+        tensors[thread] = interpolate.nextStagingFrame()
+
+    for _ in range(20):
+        workers = [
+            threading.Thread(target=setupFrame, args=(thread,))
+            for thread in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # the pool is as large as the number of threads, so no two calls of a round can share a tensor
+        assert len({id(tensor) for tensor in tensors}) == threads